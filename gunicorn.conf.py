@@ -0,0 +1,167 @@
+"""
+Gunicorn configuration
+
+Gunicorn loads this file from the working directory when it starts.
+
+The app is imported once in the master process (preload_app) and the
+workers are forked from it, so they share the memory holding flask-restx,
+the Swagger models and the compiled serializers through copy-on-write.
+Each worker reports at startup how much of its memory is still shared.
+
+With GUNICORN_WORKER_CLASS=gevent each worker serves up to
+worker_connections requests at once, switching between them while they
+wait on Postgres, instead of one request at a time. `make bench-workers`
+compares the two modes.
+
+Every setting can be overridden with the GUNICORN_* environment variables
+below, or on the command line.
+"""
+import gc
+import math
+import os
+
+# "sync" workers serve one request at a time; "gevent" workers serve many
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+if worker_class == "gevent":
+    # Patch before preload_app imports the app, so the engine's pool, the
+    # log thread and psycopg are all built on cooperative primitives
+    from gevent import monkey  # pylint: disable=wrong-import-position
+
+    monkey.patch_all()
+    # psycopg's default C wait function would block the whole worker, while
+    # wait_select() goes through the patched select() and yields instead
+    os.environ.setdefault("PSYCOPG_WAIT_FUNC", "wait_select")
+    # A log listener "thread" is a greenlet here, and greenlets are copied
+    # into every forked worker, so log from the request greenlets instead
+    os.environ.setdefault("LOG_ASYNC", "false")
+    # Requests beyond the DB_POOL_SIZE + DB_MAX_OVERFLOW connections of a
+    # worker wait for a connection for up to DB_POOL_TIMEOUT seconds
+    worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+
+# Import the app in the master and fork the workers from it
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("true", "1", "yes")
+
+
+def cpu_quota(cgroup_root: str = "/sys/fs/cgroup") -> float:
+    """Returns the CPUs this process may use, honoring a container CPU limit
+
+    os.cpu_count() reports every CPU of the host, even in a container
+    limited to a fraction of one, so the cgroup quota is checked first.
+    """
+    try:  # cgroup v2: "<quota> <period>", or "max <period>" without a limit
+        quota, period = _read(os.path.join(cgroup_root, "cpu.max")).split()
+    except (OSError, ValueError):
+        try:  # cgroup v1: the quota is -1 without a limit
+            quota = _read(os.path.join(cgroup_root, "cpu", "cpu.cfs_quota_us"))
+            period = _read(os.path.join(cgroup_root, "cpu", "cpu.cfs_period_us"))
+        except OSError:
+            quota = period = "max"
+    if quota not in ("max", "-1"):
+        return int(quota) / int(period)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _read(path: str) -> str:
+    with open(path, encoding="utf-8") as file:
+        return file.read().strip()
+
+
+# Sync: two workers per usable CPU plus one, so a worker waiting on the
+# database doesn't leave a CPU idle. Gevent: one per CPU, as a gevent worker
+# keeps its CPU busy by itself
+if worker_class == "gevent":
+    workers = int(os.getenv("GUNICORN_WORKERS", "0")) or math.ceil(cpu_quota())
+else:
+    workers = int(os.getenv("GUNICORN_WORKERS", "0")) or 2 * math.ceil(cpu_quota()) + 1
+
+# Replace each worker after about max_requests requests, with jitter so
+# they don't all restart at once, to bound slow memory growth
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", str(max_requests // 10)))
+
+
+######################################################################
+#  S E R V E R   H O O K S
+######################################################################
+def when_ready(server):
+    """Freezes the objects the master made so workers keep sharing their pages
+
+    Without this, the first garbage collection in a worker writes to the
+    header of every preloaded object and copies most pages of the master.
+
+    The worker count, which the command line may have changed, is passed on
+    to the app first, as a "local" cache is only usable by a single worker.
+    """
+    os.environ["GUNICORN_WORKERS"] = str(server.cfg.workers)
+    if server.cfg.preload_app:
+        from service.models import cache  # pylint: disable=import-outside-toplevel
+
+        if not cache.share_with(server.cfg.workers):
+            server.log.warning('CACHE_BACKEND "local" needs a single worker, the cache is off')
+    gc.freeze()
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Drops the database connections a worker inherited from the master
+
+    Sharing a pooled connection between processes corrupts it, so each
+    worker starts with an empty pool of its own. close=False leaves the
+    master's connections, if it opened any, open for the master.
+    """
+    if not server.cfg.preload_app:
+        return
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.models import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    """Logs how much of the worker's memory is still shared with the master"""
+    usage = memory_usage()
+    if usage:
+        worker.log.info(
+            "Worker %s memory: %.1f MiB resident, %.1f MiB shared with the master, %.1f MiB private",
+            worker.pid,
+            usage["rss"] / 1024,
+            usage["shared"] / 1024,
+            usage["private"] / 1024,
+        )
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drops the live metric samples of a worker that has exited"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # pylint: disable=import-outside-toplevel
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def memory_usage(path: str = "/proc/self/smaps_rollup") -> dict:
+    """Returns the resident, shared and private memory of this process in KiB
+
+    Shared pages are the ones still shared with the master, or with other
+    workers, through copy-on-write. Returns {} where /proc is not available.
+    """
+    try:
+        text = _read(path)
+    except OSError:
+        return {}
+    sizes = {}
+    for line in text.splitlines()[1:]:
+        name, _, value = line.partition(":")
+        sizes[name] = int(value.split()[0])
+    return {
+        "rss": sizes.get("Rss", 0),
+        "shared": sizes.get("Shared_Clean", 0) + sizes.get("Shared_Dirty", 0),
+        "private": sizes.get("Private_Clean", 0) + sizes.get("Private_Dirty", 0),
+    }
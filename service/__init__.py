@@ -4,22 +4,15 @@ Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
 """
-import sys
 from flask import Flask
 from flask_restx import Api
 from service import config
-from service.common import log_handlers
-
-# Create Flask application
-app = Flask(__name__)
-app.config.from_object(config)
-# app.url_map.strict_slashes = False
+from service.common import log_handlers, metrics
 
 ######################################################################
 # Configure Swagger before initializing it
 ######################################################################
 api = Api(
-    app,
     version="1.0.0",
     title="Wishlist Demo REST API Service",
     description="This is Wishlists microservice for an e-commerce app.",
@@ -29,25 +22,47 @@ api = Api(
     prefix="/api",
 )
 
-# Dependencies require we import the routes AFTER the Flask app is created
-# pylint: disable=wrong-import-position, wrong-import-order, cyclic-import
-from service import routes, models  # noqa: E402, E261
 
-# pylint: disable=wrong-import-position
-from service.common import error_handlers, cli_commands  # noqa: F401, E402
+######################################################################
+# Application Factory
+######################################################################
+def create_app(config_object=config) -> Flask:
+    """Creates the Flask application without connecting to the database
+
+    The engine connects on first use and retries while the database is
+    briefly unavailable, so workers start even during a database restart.
+    Tables are made, and the schema checked, by the one-shot
+    `flask db-check --create` step instead of by every worker.
+    """
+    app = Flask(__name__)  # pylint: disable=redefined-outer-name
+    app.config.from_object(config_object)
+    # app.url_map.strict_slashes = False
+
+    # Dependencies require we import the routes AFTER the Api is created
+    # pylint: disable=import-outside-toplevel, cyclic-import
+    from service import routes, models
+    from service.common import error_handlers, cli_commands
+
+    api.init_app(app)
+    app.register_blueprint(routes.blueprint)
+    app.register_blueprint(error_handlers.blueprint)
+    app.register_blueprint(cli_commands.blueprint)
+
+    # Set up logging for production
+    log_handlers.init_logging(app, "gunicorn.error")
+
+    # Record request and SQL metrics for /metrics
+    metrics.init_metrics(app)
+
+    app.logger.info(70 * "*")
+    app.logger.info("  W I S H L I S T   S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
+    models.init_db(app)  # connects lazily, see create_app()
 
-app.logger.info(70 * "*")
-app.logger.info("  W I S H L I S T   S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+    app.logger.info("Service initialized!")
+    return app
 
-try:
-    models.init_db(app)  # make our SQLAlchemy tables
-except Exception as error:  # pylint: disable=broad-except
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
 
-app.logger.info("Service initialized!")
+# The app gunicorn and `flask` load as service:app
+app = create_app()
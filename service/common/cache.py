@@ -0,0 +1,219 @@
+"""
+Cache
+
+This module contains the read-through cache that sits under the model
+finders, with an in-process LRU backend and an optional shared Redis backend
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+######################################################################
+#  B A C K E N D S
+######################################################################
+class LocalCache:
+    """In-process LRU cache whose entries expire after a time to live
+
+    Each worker process has its own LocalCache, so it only sees the
+    invalidations made by its own writes. Keep the TTL short, or use
+    RedisCache, when several workers serve the same data.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Returns the value stored under key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: int = None):
+        """Stores a value under key, evicting the least recently used entry"""
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys: str):
+        """Removes the entries stored under keys"""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        """Adds one to the counter stored under key and returns it"""
+        with self._lock:
+            value = self._entries.get(key, (0, None))[0] + 1
+            self._entries[key] = (value, None)
+            return value
+
+    def clear(self):
+        """Removes every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    """Cache shared by every worker, kept in Redis or a Redis-protocol server"""
+
+    def __init__(self, url: str, prefix: str = "wishlists:", client=None):
+        if client is None:
+            import redis  # pylint: disable=import-outside-toplevel
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str):
+        """Returns the value stored under key, or None"""
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else pickle.loads(raw)
+
+    def set(self, key: str, value, ttl: int = None):
+        """Stores a value under key for ttl seconds"""
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl or None)
+
+    def delete(self, *keys: str):
+        """Removes the entries stored under keys"""
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def incr(self, key: str) -> int:
+        """Adds one to the counter stored under key and returns it"""
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        """Removes every entry under our prefix"""
+        keys = list(self.client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*"))
+
+
+class NullCache:
+    """Cache that stores nothing, used when caching is turned off"""
+
+    def get(self, key: str):  # pylint: disable=unused-argument
+        """Always misses"""
+        return None
+
+    def set(self, key: str, value, ttl: int = None):
+        """Drops the value"""
+
+    def delete(self, *keys: str):
+        """Nothing to remove"""
+
+    def incr(self, key: str) -> int:  # pylint: disable=unused-argument
+        """Counters always read 0"""
+        return 0
+
+    def clear(self):
+        """Nothing to remove"""
+
+    def __len__(self):
+        return 0
+
+
+######################################################################
+#  M O D E L   C A C H E
+######################################################################
+class ModelCache:
+    """Read-through cache of model rows that counts its hits and misses
+
+    Rows are stored as plain column values under "<table>:<generation>:<id>"
+    and pages of rows under "<table>:list:<generation>:<args>". Writes
+    delete the keys of the rows they touch and bump the list generation;
+    bulk statements, which may touch any row, bump the row generation too.
+    """
+
+    def __init__(self):
+        self.backend = NullCache()
+        self.ttl = None
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """Selects the backend named by the CACHE_BACKEND setting"""
+        name = app.config.get("CACHE_BACKEND", "none")
+        if name == "redis":
+            self.backend = RedisCache(app.config["CACHE_URL"])
+        elif name == "local":
+            self.backend = LocalCache(app.config.get("CACHE_MAX_ENTRIES", 10000))
+        else:
+            self.backend = NullCache()
+        self.ttl = app.config.get("CACHE_TTL")
+        self.hits = self.misses = 0
+        if not self.share_with(app.config.get("WORKERS", 1)):
+            app.logger.warning('CACHE_BACKEND "local" needs a single worker, the cache is off')
+
+    def share_with(self, workers: int) -> bool:
+        """Turns a "local" cache off when more than one worker serves the app
+
+        Each worker would keep a copy of its own, which a write in another
+        worker never invalidates. Returns False when the cache was turned off.
+        """
+        if workers > 1 and isinstance(self.backend, LocalCache):
+            self.backend = NullCache()
+            return False
+        return True
+
+    def generation(self, table: str, kind: str = "rows") -> int:
+        """Returns the current row or list generation of a table"""
+        return self.backend.get(f"{table}:{kind}-generation") or 0
+
+    def row_key(self, table: str, by_id) -> str:
+        """Returns the key of one row"""
+        return f"{table}:{self.generation(table)}:{by_id}"
+
+    def list_key(self, table: str, *args) -> str:
+        """Returns the key of a list of rows fetched with args"""
+        generation = f"{self.generation(table)}.{self.generation(table, 'list')}"
+        return f"{table}:list:{generation}:" + ":".join(str(arg) for arg in args)
+
+    def get(self, key: str):
+        """Returns the cached value under key, counting the hit or miss"""
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value):
+        """Caches a value under key for the configured TTL"""
+        self.backend.set(key, value, self.ttl)
+
+    def invalidate(self, table: str, ids=(), bulk: bool = False):
+        """Forgets the given rows and every cached list of a table"""
+        if bulk:
+            self.backend.incr(f"{table}:rows-generation")
+        self.backend.delete(*[self.row_key(table, by_id) for by_id in ids])
+        self.backend.incr(f"{table}:list-generation")
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters of this process"""
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -1,8 +1,15 @@
 """
 Flask CLI Command Extensions
 """
-from service import app
-from service.models import db
+import csv
+import click
+from flask import Blueprint, current_app
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import DropIndex
+from service.models import DataValidationError, IdempotencyKey, WishlistItem, db
+
+# Commands registered at the top level of the flask command
+blueprint = Blueprint("cli", __name__, cli_group=None)
 
 
 ######################################################################
@@ -10,7 +17,7 @@ from service.models import db
 # Usage:
 #   flask db-create
 ######################################################################
-@app.cli.command("db-create")
+@blueprint.cli.command("db-create")
 def db_create():
     """
     Recreates a local database. You probably should not use this on
@@ -19,3 +26,235 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to check, and optionally make, the schema before a deploy
+# Usage:
+#   flask db-check [--create]
+######################################################################
+@blueprint.cli.command("db-check")
+@click.option("--create", is_flag=True, help="Create missing tables and indexes first")
+def db_check(create):
+    """
+    Checks that every declared table, column and index exists, and exits
+    with status 1 if not. Run it once per deploy before the workers start,
+    which no longer create tables themselves.
+    """
+    if create:
+        db.create_all()  # only creates the tables that are missing
+        db.session.commit()
+        for index in missing_indexes():
+            click.echo(f"Building index {index.name} on {index.table.name} ...")
+            build_index(index)
+    problems = schema_problems()
+    for problem in problems:
+        click.echo(problem)
+    if problems:
+        raise click.ClickException(f"The database schema has {len(problems)} problems")
+    click.echo("The database schema is up to date")
+
+
+######################################################################
+# Command to report on and build the declared indexes
+# Usage:
+#   flask db-indexes [--dry-run]
+######################################################################
+@blueprint.cli.command("db-indexes")
+@click.option("--dry-run", is_flag=True, help="Only report, do not build indexes")
+def db_indexes(dry_run):
+    """
+    Reports index usage and builds any declared indexes that are missing.
+    On PostgreSQL indexes are built CONCURRENTLY so writes are not blocked.
+    """
+    for line in index_usage_report():
+        click.echo(line)
+    # a concurrent build waits for open transactions, so end ours first
+    db.session.commit()
+    for index in missing_indexes():
+        if dry_run:
+            click.echo(f"Missing index {index.name} on {index.table.name}")
+            continue
+        click.echo(f"Building index {index.name} on {index.table.name} ...")
+        build_index(index)
+
+
+######################################################################
+# Command to merge Items that hold the same product in a wishlist
+# Usage:
+#   flask db-dedupe [--batch-size 1000]
+######################################################################
+@blueprint.cli.command("db-dedupe")
+@click.option("--batch-size", default=1000, show_default=True, help="Duplicate groups merged per transaction")
+def db_dedupe(batch_size):
+    """
+    Merges duplicate products of each wishlist into one Item, in batches.
+    Run it before db-indexes builds the unique (wishlist_id, product_id) index.
+    """
+    merged = 0
+    while True:
+        count = WishlistItem.dedupe(batch_size)
+        if not count:
+            break
+        merged += count
+        click.echo(f"Merged {merged} duplicate products so far ...")
+    click.echo(f"Merged {merged} duplicate products")
+
+
+######################################################################
+# Command to propagate new catalog prices to every Wishlist Item
+# Usage:
+#   flask update-prices prices.csv [--chunk-size 1000] [--max-rows 10000]
+######################################################################
+@blueprint.cli.command("update-prices")
+@click.argument("prices_file", type=click.File("r"))
+@click.option("--chunk-size", type=int, help="Products per UPDATE, PRICE_CHUNK_SIZE by default")
+@click.option("--max-rows", type=int, help="Items changed per transaction, PRICE_MAX_ROWS by default")
+def update_prices(prices_file, chunk_size, max_rows):
+    """
+    Sets the product_price of every Item from a CSV file of
+    product_id,product_price rows, with or without a header row.
+    """
+    rows = csv.DictReader(prices_file, fieldnames=("product_id", "product_price"))
+    try:
+        prices = WishlistItem.deserialize_prices(
+            row for row in rows if row["product_id"] != "product_id"
+        )
+    except DataValidationError as error:
+        raise click.ClickException(str(error)) from error
+
+    def report(done, total, updated):
+        click.echo(f"Priced {done} of {total} products, {updated} items updated")
+
+    updated = WishlistItem.update_prices(
+        prices,
+        chunk_size or current_app.config["PRICE_CHUNK_SIZE"],
+        max_rows or current_app.config["PRICE_MAX_ROWS"],
+        progress=report,
+    )
+    click.echo(f"Updated the price of {updated} items")
+
+
+######################################################################
+# Command to delete the Idempotency-Keys that are no longer replayed
+# Usage:
+#   flask purge-idempotency-keys [--ttl 86400]
+######################################################################
+@blueprint.cli.command("purge-idempotency-keys")
+@click.option("--ttl", type=int, help="Age in seconds of the keys to delete, IDEMPOTENCY_TTL by default")
+def purge_idempotency_keys(ttl):
+    """
+    Deletes the stored responses of POSTs whose Idempotency-Key expired.
+    Run it on a schedule to keep the idempotency_keys table small.
+    """
+    deleted = IdempotencyKey.purge(ttl or current_app.config["IDEMPOTENCY_TTL"])
+    click.echo(f"Deleted {deleted} expired idempotency keys")
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def index_usage_report() -> list:
+    """Returns one line per index on our tables with its usage statistics"""
+    tables = list(db.metadata.tables)
+    if db.engine.dialect.name != "postgresql":
+        inspector = inspect(db.engine)
+        return [
+            f"{table}.{index['name']} scans=n/a"
+            for table in tables
+            if inspector.has_table(table)
+            for index in inspector.get_indexes(table)
+        ]
+    rows = db.session.execute(
+        text(
+            "SELECT s.relname, s.indexrelname, s.idx_scan,"
+            " pg_relation_size(s.indexrelid), i.indisvalid"
+            " FROM pg_stat_user_indexes s"
+            " JOIN pg_index i ON i.indexrelid = s.indexrelid"
+            " WHERE s.relname = ANY(:tables)"
+            " ORDER BY s.relname, s.indexrelname"
+        ),
+        {"tables": tables},
+    )
+    return [
+        f"{table}.{name} scans={scans} size={size} bytes" + ("" if valid else " INVALID")
+        for table, name, scans, size, valid in rows
+    ]
+
+
+def schema_problems() -> list:
+    """Returns one line per declared table, column or index that is missing"""
+    inspector = inspect(db.engine)
+    problems = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            problems.append(f"Missing table {table.name}")
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        problems.extend(
+            f"Missing column {table.name}.{column.name}, it must be added by hand"
+            for column in table.columns
+            if column.name not in existing
+        )
+    problems.extend(
+        f"Missing index {index.name} on {index.table.name}" for index in missing_indexes()
+    )
+    return problems
+
+
+def missing_indexes() -> list:
+    """Returns the declared indexes that do not exist in the database
+
+    An index left INVALID by a failed CREATE INDEX CONCURRENTLY is not used
+    by queries or ON CONFLICT, so it counts as missing too.
+    """
+    inspector = inspect(db.engine)
+    invalid = invalid_indexes()
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)} - invalid
+        missing.extend(
+            index for index in table.indexes if index.name not in existing and built_here(index)
+        )
+    return missing
+
+
+def built_here(index) -> bool:
+    """Returns False for an index whose ddl_if() leaves out this database"""
+    ddl_if = index._ddl_if  # pylint: disable=protected-access
+    return ddl_if is None or ddl_if._should_execute(None, index, db.engine)  # pylint: disable=protected-access
+
+
+def invalid_indexes() -> set:
+    """Returns the names of the PostgreSQL indexes marked INVALID"""
+    if db.engine.dialect.name != "postgresql":
+        return set()
+    rows = db.session.execute(
+        text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid"
+            " WHERE NOT i.indisvalid AND pg_table_is_visible(c.oid)"
+        )
+    )
+    return {name for (name,) in rows}
+
+
+def build_index(index):
+    """Builds an index outside of a transaction, concurrently on PostgreSQL
+
+    An INVALID index of the same name, left by an earlier failed build, is
+    dropped first, concurrently as well.
+    """
+    postgresql = db.engine.dialect.name == "postgresql"
+    options = index.dialect_options["postgresql"]
+    options["concurrently"] = postgresql
+    try:
+        with db.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as conn:
+            if postgresql:
+                conn.execute(DropIndex(index, if_exists=True))
+            index.create(conn)
+    finally:
+        options["concurrently"] = False
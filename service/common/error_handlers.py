@@ -17,26 +17,65 @@
 """
 Module: error_handlers
 """
-from flask import jsonify
-from service.models import DataValidationError
-from service import app
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy.exc import IntegrityError
+from service import api
+from service.models import DataValidationError, VersionConflictError, db
 from . import status
 
+# Error handlers registered on the whole application
+blueprint = Blueprint("error_handlers", __name__)
+
 
 ######################################################################
 # Error Handlers
 ######################################################################
-@app.errorhandler(DataValidationError)
+@blueprint.app_errorhandler(DataValidationError)
 def request_validation_error(error):
     """Handles Value Errors from bad data"""
     return bad_request(error)
 
 
-@app.errorhandler(status.HTTP_400_BAD_REQUEST)
+@blueprint.app_errorhandler(VersionConflictError)
+def version_conflict_error(error):
+    """Handles updates made against a stale version"""
+    return precondition_failed(error)
+
+
+@blueprint.app_errorhandler(IntegrityError)
+def integrity_error(error):
+    """Handles writes that break a constraint, such as a duplicate product"""
+    db.session.rollback()
+    current_app.logger.warning(str(error.orig))
+    return resource_conflict("The request conflicts with data that already exists")
+
+
+def resource_error(handler):
+    """Returns an Api error handler that answers as an app error handler does
+
+    flask-restx answers an exception raised inside a Resource itself, and
+    only hands it on to the app error handlers when exceptions propagate,
+    which is under TESTING or DEBUG. Without this, production would answer
+    these exceptions with a bare 500.
+    """
+
+    def handle(error):
+        response, code = handler(error)
+        return response.get_json(), code
+
+    return handle
+
+
+api.errorhandler(DataValidationError)(resource_error(request_validation_error))
+api.errorhandler(VersionConflictError)(resource_error(version_conflict_error))
+api.errorhandler(IntegrityError)(resource_error(integrity_error))
+
+
+@blueprint.app_errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """Handles bad requests with 400_BAD_REQUEST"""
     message = str(error)
-    app.logger.warning(message)
+    current_app.logger.warning(message)
     return (
         jsonify(
             status=status.HTTP_400_BAD_REQUEST, error="Bad Request", message=message
@@ -45,22 +84,37 @@ def bad_request(error):
     )
 
 
-@app.errorhandler(status.HTTP_404_NOT_FOUND)
+@blueprint.app_errorhandler(status.HTTP_404_NOT_FOUND)
 def not_found(error):
     """Handles resources not found with 404_NOT_FOUND"""
     message = str(error)
-    app.logger.warning(message)
+    current_app.logger.warning(message)
     return (
         jsonify(status=status.HTTP_404_NOT_FOUND, error="Not Found", message=message),
         status.HTTP_404_NOT_FOUND,
     )
 
 
-# @app.errorhandler(status.HTTP_405_METHOD_NOT_ALLOWED)
+@blueprint.app_errorhandler(status.HTTP_412_PRECONDITION_FAILED)
+def precondition_failed(error):
+    """Handles failed If-Match preconditions with 412_PRECONDITION_FAILED"""
+    message = str(error)
+    current_app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_412_PRECONDITION_FAILED,
+            error="Precondition Failed",
+            message=message,
+        ),
+        status.HTTP_412_PRECONDITION_FAILED,
+    )
+
+
+# @blueprint.app_errorhandler(status.HTTP_405_METHOD_NOT_ALLOWED)
 # def method_not_supported(error):
 #     """Handles unsupported HTTP methods with 405_METHOD_NOT_SUPPORTED"""
 #     message = str(error)
-#     app.logger.warning(message)
+#     current_app.logger.warning(message)
 #     return (
 #         jsonify(
 #             status=status.HTTP_405_METHOD_NOT_ALLOWED,
@@ -71,26 +125,41 @@ def not_found(error):
 #     )
 
 
-# @app.errorhandler(status.HTTP_409_CONFLICT)
-# def resource_conflict(error):
-#     """Handles resource conflicts with HTTP_409_CONFLICT"""
-#     message = str(error)
-#     app.logger.warning(message)
-#     return (
-#         jsonify(
-#             status=status.HTTP_409_CONFLICT,
-#             error="Conflict",
-#             message=message,
-#         ),
-#         status.HTTP_409_CONFLICT,
-#     )
+@blueprint.app_errorhandler(status.HTTP_409_CONFLICT)
+def resource_conflict(error):
+    """Handles resource conflicts with HTTP_409_CONFLICT"""
+    message = str(error)
+    current_app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_409_CONFLICT,
+            error="Conflict",
+            message=message,
+        ),
+        status.HTTP_409_CONFLICT,
+    )
+
+
+@blueprint.app_errorhandler(status.HTTP_422_UNPROCESSABLE_ENTITY)
+def unprocessable_entity(error):
+    """Handles requests that can't be processed with HTTP_422_UNPROCESSABLE_ENTITY"""
+    message = str(error)
+    current_app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            error="Unprocessable Entity",
+            message=message,
+        ),
+        status.HTTP_422_UNPROCESSABLE_ENTITY,
+    )
 
 
-# @app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+# @blueprint.app_errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 # def mediatype_not_supported(error):
 #     """Handles unsupported media requests with 415_UNSUPPORTED_MEDIA_TYPE"""
 #     message = str(error)
-#     app.logger.warning(message)
+#     current_app.logger.warning(message)
 #     return (
 #         jsonify(
 #             status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
@@ -101,11 +170,11 @@ def not_found(error):
 #     )
 
 
-# @app.errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
+# @blueprint.app_errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
 # def internal_server_error(error):
 #     """Handles unexpected server error with 500_SERVER_ERROR"""
 #     message = str(error)
-#     app.logger.error(message)
+#     current_app.logger.error(message)
 #     return (
 #         jsonify(
 #             status=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -20,17 +20,178 @@ Log Handlers
 This module contains utility functions to set up logging
 consistently
 """
+import atexit
+import json
 import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+from flask import has_request_context, request
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+# (listener, handler, max_size) of every listener started in this process,
+# restarted by the one os.register_at_fork() hook, which can't be removed
+_LISTENERS = []
 
 
 def init_logging(app, logger_name: str):
-    """Set up logging for production"""
+    """Set up logging for production
+
+    With LOG_FORMAT=json each record is written as one JSON object. With
+    LOG_ASYNC set, the handlers run on a background QueueListener thread so
+    a request only pays for putting the record on a queue.
+    """
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
+    if app.config.get("LOG_FORMAT") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT, DATE_FORMAT)
     for handler in app.logger.handlers:
         handler.setFormatter(formatter)
+    if app.config.get("LOG_ASYNC") and app.logger.handlers:
+        start_queue_listener(app.logger, app.config.get("LOG_QUEUE_SIZE", 10000))
+    app.logger.addFilter(RequestFilter(app.config.get("LOG_SAMPLE_RATES", {})))
     app.logger.info("Logging handler established")
+
+
+def start_queue_listener(logger, max_size: int = 10000) -> QueueListener:
+    """Moves the handlers of a logger onto a background thread"""
+    log_queue = queue.Queue(max_size)
+    listener = QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    handler = DeferredQueueHandler(log_queue, logger.handlers)
+    logger.handlers = [handler]
+    listener.start()
+    atexit.register(listener.stop)
+    if hasattr(os, "register_at_fork") and not _LISTENERS:
+        os.register_at_fork(after_in_child=restart_queue_listeners)
+    _LISTENERS.append((listener, handler, max_size))
+    return listener
+
+
+def restart_queue_listeners():
+    """Restarts every listener of this process in a forked child"""
+    for listener, handler, max_size in _LISTENERS:
+        restart_queue_listener(listener, handler, max_size)
+
+
+def restart_queue_listener(listener: QueueListener, handler: QueueHandler, max_size: int = 10000):
+    """Starts a new listener thread in a forked process, such as a gunicorn worker
+
+    Threads do not survive a fork, so without this a worker forked from a
+    preloaded master would queue its records with nothing to write them.
+    The queue is replaced too, as the master's thread may have held its lock.
+    """
+    log_queue = queue.Queue(max_size)
+    listener.queue = handler.queue = log_queue
+    listener._thread = None  # pylint: disable=protected-access
+    listener.start()
+
+
+######################################################################
+#  H A N D L E R S ,   F I L T E R S   A N D   F O R M A T T E R S
+######################################################################
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock QueueHandler formats every message before queueing it, so a
+    large payload is still rendered on the request path. Here the message
+    and its arguments are queued as they are.
+
+    When the queue is full, warnings and errors are written right away by
+    the listener's handlers, and info and debug records are dropped rather
+    than waited for. How many were dropped is logged once the queue has
+    room again.
+
+    Args:
+        handlers (list): the handlers of the listener that reads the queue
+    """
+
+    def __init__(self, log_queue, handlers=()):
+        super().__init__(log_queue)
+        self.handlers = list(handlers)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                self.handle_now(record)
+            else:
+                self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            self.handle_now(
+                logging.LogRecord(
+                    name=record.name,
+                    level=logging.WARNING,
+                    pathname=__file__,
+                    lineno=0,
+                    msg="%d log records were dropped while the log queue was full",
+                    args=(dropped,),
+                    exc_info=None,
+                )
+            )
+
+    def handle_now(self, record):
+        """Writes a record with the listener's handlers on this thread"""
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+class RequestFilter(logging.Filter):
+    """Tags records with the request they were logged in and samples them
+
+    Args:
+        sample_rates (dict): fraction of info and debug records to keep, by
+            endpoint; warnings and errors are always kept
+    """
+
+    def __init__(self, sample_rates: dict = None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        record.endpoint = request.endpoint
+        record.method = request.method
+        record.path = request.path
+        rate = self.sample_rates.get(request.endpoint)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one line of JSON"""
+
+    def __init__(self):
+        super().__init__(datefmt=DATE_FORMAT)
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        for key in ("endpoint", "method", "path"):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
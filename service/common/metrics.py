@@ -0,0 +1,207 @@
+"""
+Metrics
+
+This module records request latency, response sizes and SQL statements
+and exports them in the Prometheus text format. It also adds a
+Server-Timing header to each response and checks the number of SQL
+statements a request ran against its budget.
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty directory that
+every worker can write to before the service starts. Each worker then
+keeps its samples in files there, and /metrics adds up all of them
+whichever worker answers the scrape. gunicorn.conf.py drops the files
+of workers that exit.
+"""
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUEST_LATENCY = Histogram(
+    "wishlists_request_duration_seconds",
+    "Time spent handling a request",
+    ["endpoint", "method", "status"],
+)
+RESPONSE_SIZE = Histogram(
+    "wishlists_response_size_bytes",
+    "Size of response bodies that have a known length",
+    ["endpoint", "method"],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000),
+)
+REQUEST_STATEMENTS = Histogram(
+    "wishlists_request_sql_statements",
+    "SQL statements run while handling a request",
+    ["endpoint", "method"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+SQL_DURATION = Histogram(
+    "wishlists_sql_duration_seconds",
+    "Time spent running SQL statements",
+    ["endpoint"],
+)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a request runs more SQL statements than its budget allows"""
+
+
+######################################################################
+#  F L A S K   H O O K S
+######################################################################
+def init_metrics(app):
+    """Records metrics for every request the app handles"""
+    app.before_request(start_request)
+    app.after_request(record_request)
+
+
+def endpoint_label() -> str:
+    """Returns the endpoint of the current request, or a placeholder outside one"""
+    if not has_request_context():
+        return "none"
+    return request.endpoint or "unmatched"
+
+
+def start_request():
+    """Starts the clocks and the statement counter of a request"""
+    g.metrics_start = time.perf_counter()
+    g.metrics_statements = 0
+    g.metrics_timings = {"db": 0.0}
+
+
+def record_request(response):
+    """Observes the latency, size and statement count of a finished request"""
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    endpoint = endpoint_label()
+    statements = g.pop("metrics_statements", 0)
+    timings = dict(g.pop("metrics_timings", {}), total=total)
+    REQUEST_LATENCY.labels(endpoint, request.method, response.status_code).observe(total)
+    REQUEST_STATEMENTS.labels(endpoint, request.method).observe(statements)
+    size = response.calculate_content_length()
+    if size is not None:
+        RESPONSE_SIZE.labels(endpoint, request.method).observe(size)
+    response.headers["Server-Timing"] = ", ".join(
+        f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items()
+    )
+    check_query_budget(endpoint, statements)
+    return response
+
+
+######################################################################
+#  S E R V E R   T I M I N G
+######################################################################
+@contextmanager
+def timing(name: str):
+    """Adds the time spent in the block to the request's Server-Timing entry
+
+    Nested blocks with the same name, such as a Wishlist serializing its
+    items, are only counted once.
+    """
+    timings = g.get("metrics_timings") if has_request_context() else None
+    active = g.setdefault("metrics_active", set()) if timings is not None else set()
+    if timings is None or name in active:
+        yield
+        return
+    active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        active.discard(name)
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def timed(name: str):
+    """Decorator that adds the time spent in a function to a Server-Timing entry"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timing(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+######################################################################
+#  Q U E R Y   B U D G E T
+######################################################################
+def check_query_budget(endpoint: str, statements: int):
+    """Logs, or raises when SQL_QUERY_BUDGET_STRICT is set, an exceeded budget
+
+    The budget of an endpoint is taken from SQL_QUERY_BUDGETS and falls back
+    to SQL_QUERY_BUDGET. A budget that is not set, or is 0, is not checked.
+    """
+    config = current_app.config
+    budget = config.get("SQL_QUERY_BUDGETS", {}).get(endpoint, config.get("SQL_QUERY_BUDGET"))
+    if not budget or statements <= budget:
+        return
+    message = (
+        f"{request.method} {request.path} ran {statements} SQL statements, "
+        f"over the budget of {budget} for {endpoint}"
+    )
+    if config.get("SQL_QUERY_BUDGET_STRICT"):
+        raise QueryBudgetExceeded(message)
+    current_app.logger.warning(message)
+
+
+######################################################################
+#  S Q L A L C H E M Y   H O O K S
+######################################################################
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=too-many-arguments
+    """Starts the clock of a SQL statement"""
+    conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_statement(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=too-many-arguments
+    """Observes the duration of a SQL statement and counts it for the request"""
+    starts = conn.info.get("metrics_start")
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    SQL_DURATION.labels(endpoint_label()).observe(duration)
+    if has_request_context() and "metrics_statements" in g:
+        g.metrics_statements += 1
+        g.metrics_timings["db"] += duration
+
+
+@event.listens_for(Engine, "handle_error")
+def drop_failed_statement(context):
+    """Forgets the clock of a SQL statement that raised"""
+    starts = context.connection.info.get("metrics_start") if context.connection else None
+    if starts:
+        starts.pop()
+
+
+######################################################################
+#  E X P O R T
+######################################################################
+def metrics_registry():
+    """Returns the registry to export, merging every worker's samples if needed"""
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def export_metrics():
+    """Returns the metrics text and its content type"""
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
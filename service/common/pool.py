@@ -0,0 +1,125 @@
+"""
+Pool
+
+This module contains the connection pool used for the database engine,
+which records how long requests wait to check out a connection, and the
+retry of new connections while the database is briefly unavailable
+"""
+import logging
+import threading
+import time
+from functools import partial
+from retry.api import retry_call
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("flask.app")
+
+
+class PoolMetrics:
+    """Counts checkouts, the time spent waiting for them and timeouts"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, waited: float, timed_out: bool = False):
+        """Adds one checkout that waited for the given number of seconds"""
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def snapshot(self) -> dict:
+        """Returns the counters as a dictionary"""
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "max_wait_seconds": round(self.max_wait_seconds, 6),
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited
+
+    The wait covers blocking on a full pool as well as opening a new
+    connection when the pool is below its size, which is what a request
+    actually pays before it can run its first statement.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - start)
+        return conn
+
+
+def pool_stats(engine) -> dict:
+    """Returns the live statistics of an engine's connection pool"""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow,  # pylint: disable=protected-access
+            }
+        )
+    metrics = getattr(pool, "metrics", None)
+    if metrics is not None:
+        stats.update(metrics.snapshot())
+    return stats
+
+
+def retry_connections(engine, tries: int = 4, delay: float = 0.25, max_delay: float = 4.0):
+    """Retries the new connections of an engine with exponential backoff
+
+    Only OperationalError, which is what a refused or dropped connection
+    raises, is retried; bad credentials and the like fail at once.
+    """
+    event.listen(
+        engine,
+        "do_connect",
+        partial(connect_with_retry, tries=tries, delay=delay, max_delay=max_delay),
+    )
+
+
+def connect_with_retry(
+    dialect, conn_rec, cargs, cparams, tries=4, delay=0.25, max_delay=4.0
+):  # pylint: disable=too-many-arguments, unused-argument
+    """Opens a DBAPI connection, retrying while the database is unavailable"""
+    return retry_call(
+        dialect.connect,
+        fargs=cargs,
+        fkwargs=cparams,
+        exceptions=dialect.loaded_dbapi.OperationalError,
+        tries=tries,
+        delay=delay,
+        max_delay=max_delay,
+        backoff=2,
+        logger=logger,
+    )
@@ -0,0 +1,142 @@
+"""
+Replicas
+
+This module sends the reads of GET and HEAD requests to read replicas of
+the database, in turn, and keeps each client on the primary for a few
+seconds after it writes so it reads its own writes.
+
+A replica that fails is skipped for a while, then checked with SELECT 1
+before it is used again.
+"""
+import logging
+import threading
+import time
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event, text
+
+logger = logging.getLogger("flask.app")
+
+# Cookie that keeps a client that just wrote on the primary
+PRIMARY_COOKIE = "wishlists-primary"
+READ_METHODS = ("GET", "HEAD")
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class ReplicaRouter:
+    """Picks the replica for each read-only request, round-robin
+
+    Args:
+        engines (list): the engines of the replicas
+        retry_after (float): seconds a failed replica is skipped for
+    """
+
+    def __init__(self, engines=(), retry_after: float = 30.0):
+        self.engines = []
+        self.retry_after = retry_after
+        self._index = 0
+        self._down_until = {}
+        self._lock = threading.Lock()
+        for engine in engines:
+            self.add(engine)
+
+    def add(self, engine):
+        """Adds a replica, which is marked down whenever it loses its connection"""
+        self.engines.append(engine)
+        event.listen(engine, "handle_error", self._check_error)
+
+    def choose(self):
+        """Returns the next healthy replica, or None to read from the primary"""
+        with self._lock:
+            candidates = [
+                self.engines[(self._index + offset) % len(self.engines)]
+                for offset in range(len(self.engines))
+            ]
+            self._index += 1
+        now = time.monotonic()
+        for engine in candidates:
+            down_until = self._down_until.get(engine)
+            if down_until is None:
+                return engine
+            if down_until <= now and self.check(engine):
+                return engine
+        return None
+
+    def check(self, engine) -> bool:
+        """Runs SELECT 1 on a replica that was down, marking it up or down again"""
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception:  # pylint: disable=broad-except
+            self.mark_down(engine)
+            return False
+        logger.info("Replica %s is back up", engine.url.render_as_string())
+        self._down_until.pop(engine, None)
+        return True
+
+    def mark_down(self, engine):
+        """Skips a replica for retry_after seconds"""
+        logger.warning("Replica %s is down, reading from the primary", engine.url.render_as_string())
+        self._down_until[engine] = time.monotonic() + self.retry_after
+
+    def stats(self) -> list:
+        """Returns the URL, without password, and the health of each replica"""
+        return [
+            {"url": engine.url.render_as_string(), "healthy": engine not in self._down_until}
+            for engine in self.engines
+        ]
+
+    def _check_error(self, context):
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+
+######################################################################
+#  F L A S K   H O O K S
+######################################################################
+def init_replicas(app, router: ReplicaRouter):
+    """Routes the reads of each request the app handles"""
+    app.before_request(lambda: route_reads(router))
+    app.after_request(lambda response: keep_writer_on_primary(router, response))
+    app.teardown_request(lambda _: forget_replica())
+
+
+def route_reads(router: ReplicaRouter):
+    """Chooses a replica for a read-only request from a client that hasn't just written"""
+    if not router.engines or request.method not in READ_METHODS:
+        return
+    if request.cookies.get(PRIMARY_COOKIE):
+        return
+    g.db_replica = router.choose()
+
+
+def keep_writer_on_primary(router: ReplicaRouter, response):
+    """Sends the next reads of a client that wrote to the primary, for read-your-writes"""
+    seconds = current_app.config.get("DATABASE_REPLICA_STICKY", 0)
+    if not router.engines or not seconds or request.method not in WRITE_METHODS:
+        return response
+    if response.status_code < 400:
+        response.set_cookie(PRIMARY_COOKIE, "1", max_age=seconds, httponly=True, samesite="Lax")
+    return response
+
+
+def current_replica():
+    """Returns the replica chosen for the current request, if any"""
+    return g.get("db_replica") if has_app_context() else None
+
+
+def bypass_cache() -> bool:
+    """Returns True when the current request must neither read nor fill the model cache
+
+    Rows read from a replica may lag behind the primary, so they are never
+    cached, and a client that just wrote reads past the cache, where another
+    request may have left a row older than its write.
+    """
+    if current_replica() is not None:
+        return True
+    return has_request_context() and bool(request.cookies.get(PRIMARY_COOKIE))
+
+
+def forget_replica():
+    """Reads the rest of the current request from the primary"""
+    if has_app_context():
+        g.pop("db_replica", None)
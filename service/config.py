@@ -2,6 +2,7 @@
 Global Configuration for Application
 """
 import os
+from service.common.pool import TimedQueuePool
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -12,5 +13,117 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of each worker process: DB_POOL_SIZE connections are kept
+# open, up to DB_MAX_OVERFLOW more are opened under bursts, and a request
+# waits at most DB_POOL_TIMEOUT seconds for one before failing. Connections
+# are replaced after DB_POOL_RECYCLE seconds and tested before use when
+# DB_POOL_PRE_PING is set, so restarts and idle timeouts don't surface as errors
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes")
+
+# New connections are tried DB_CONNECT_TRIES times, waiting DB_CONNECT_DELAY
+# seconds after the first failure and twice as long after each next one, up
+# to DB_CONNECT_MAX_DELAY, so a database restart doesn't fail the requests
+DB_CONNECT_TRIES = int(os.getenv("DB_CONNECT_TRIES", "4"))
+DB_CONNECT_DELAY = float(os.getenv("DB_CONNECT_DELAY", "0.25"))
+DB_CONNECT_MAX_DELAY = float(os.getenv("DB_CONNECT_MAX_DELAY", "4"))
+
+# Read replicas: comma separated URIs that GET and HEAD requests read from
+# in turn. A replica that fails is skipped for DATABASE_REPLICA_RETRY
+# seconds. A client reads from the primary for DATABASE_REPLICA_STICKY
+# seconds after it writes, which should exceed the replication lag
+DATABASE_REPLICA_URIS = [
+    uri.strip() for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri.strip()
+]
+SQLALCHEMY_BINDS = {
+    f"replica_{number}": uri for number, uri in enumerate(DATABASE_REPLICA_URIS)
+}
+DATABASE_REPLICA_RETRY = float(os.getenv("DATABASE_REPLICA_RETRY", "30"))
+DATABASE_REPLICA_STICKY = int(os.getenv("DATABASE_REPLICA_STICKY", "5"))
+
+# Set DB_PGBOUNCER when DATABASE_URI points at PgBouncer in transaction
+# pooling mode, which cannot keep server-side prepared statements
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() in ("true", "1", "yes")
+
+SQLALCHEMY_ENGINE_OPTIONS = {"pool_pre_ping": DB_POOL_PRE_PING}
+if not DATABASE_URI.startswith("sqlite"):
+    SQLALCHEMY_ENGINE_OPTIONS.update(
+        {
+            "poolclass": TimedQueuePool,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+        }
+    )
+if DB_PGBOUNCER:
+    SQLALCHEMY_ENGINE_OPTIONS["connect_args"] = {"prepare_threshold": None}
+
+# Largest page a client may request with ?limit= on collection endpoints
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+
+# Rows fetched per round trip when streaming application/x-ndjson exports
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Largest number of entries accepted by one batch request
+BATCH_SIZE_MAX = int(os.getenv("BATCH_SIZE_MAX", "1000"))
+
+# Bulk price updates: (product_id, price) pairs per UPDATE statement, and
+# most Item rows changed per transaction so row locks are held briefly
+PRICE_CHUNK_SIZE = int(os.getenv("PRICE_CHUNK_SIZE", "1000"))
+PRICE_MAX_ROWS = int(os.getenv("PRICE_MAX_ROWS", "10000"))
+
+# POSTs sent with an Idempotency-Key header: seconds their response is
+# replayed to retries, and seconds after which a request that never
+# finished no longer holds its key
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "60"))
+
+# Read-through cache under Wishlist.find() and all(): "redis" shares one at
+# CACHE_URL (or REDIS_URL) and is the default when either is set, "none" is
+# off otherwise. "local" keeps an LRU cache in the process and is only used
+# by a single worker (WORKERS, which gunicorn.conf.py sets), as a write would
+# leave the copies of the other workers stale
+CACHE_URL = os.getenv("CACHE_URL") or os.getenv("REDIS_URL")
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "redis" if CACHE_URL else "none")
+CACHE_URL = CACHE_URL or "redis://localhost:6379/0"
+WORKERS = int(os.getenv("GUNICORN_WORKERS", "0")) or 1
+CACHE_TTL = int(os.getenv("CACHE_TTL", "10"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+
+# Most SQL statements one request may run before it is logged as a likely
+# N+1 query, per endpoint in SQL_QUERY_BUDGETS ("endpoint=n,endpoint=n")
+# and SQL_QUERY_BUDGET for the rest; 0 turns the check off. With
+# SQL_QUERY_BUDGET_STRICT set the request fails instead, as in the tests
+SQL_QUERY_BUDGET = int(os.getenv("SQL_QUERY_BUDGET", "10"))
+SQL_QUERY_BUDGETS = {
+    endpoint.strip(): int(budget)
+    for endpoint, _, budget in (
+        entry.partition("=") for entry in os.getenv("SQL_QUERY_BUDGETS", "").split(",") if entry
+    )
+}
+SQL_QUERY_BUDGET_STRICT = os.getenv("SQL_QUERY_BUDGET_STRICT", "false").lower() in ("true", "1", "yes")
+
+# Logging: LOG_FORMAT is "text" or "json"; LOG_ASYNC writes records from a
+# background thread; LOG_SAMPLE_RATES ("endpoint=0.1,...") keeps only that
+# fraction of the info and debug records logged by busy endpoints
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() in ("true", "1", "yes")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATES = {
+    endpoint.strip(): float(rate)
+    for endpoint, _, rate in (
+        entry.partition("=") for entry in os.getenv("LOG_SAMPLE_RATES", "").split(",") if entry
+    )
+}
+
+# Set to true to have GET endpoints render their rows with precompiled
+# serializers (and orjson when installed) instead of flask-restx marshalling.
+# Requests with an X-Fields mask are still marshalled
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() in ("true", "1", "yes")
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
@@ -3,15 +3,62 @@ Models for Wishlist
 
 All of the models are stored in this module
 """
+# pylint: disable=too-many-lines
+import base64
+import binascii
 import logging
-from datetime import date, datetime
+import re
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
 from abc import abstractmethod
+from itertools import chain
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import DDL, Select, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, make_transient_to_detached
+from service.common.cache import ModelCache
+from service.common.metrics import timed
+from service.common.pool import retry_connections
+from service.common.replicas import ReplicaRouter, bypass_cache, current_replica, forget_replica, init_replicas
 
 logger = logging.getLogger("flask.app")
 
+
+class RoutingSession(FlaskSession):  # pylint: disable=too-few-public-methods
+    """Session that runs the SELECTs of a read-only request on its replica
+
+    Everything else, including flushes and SELECT ... FOR UPDATE, runs on
+    the primary. A replica that can't be reached is marked down and the
+    request reads from the primary instead of failing.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = current_replica()
+        if (
+            replica is not None
+            and bind is None
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None  # pylint: disable=protected-access
+            and not self._flushing
+        ):
+            try:
+                self.connection(bind_arguments={"bind": replica})
+                return replica
+            except OperationalError:
+                forget_replica()
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+# Read-through cache under find() and all(), configured in init_db()
+cache = ModelCache()
+
+# Read replicas of GET requests, from DATABASE_REPLICA_URIS
+replicas = ReplicaRouter()
 
 
 # Function to initialize the database
@@ -24,6 +71,34 @@ class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class VersionConflictError(Exception):
+    """Used when a row was changed since the version a client last saw"""
+
+
+# Operations accepted by WishlistItem.apply_batch() and their result status
+BATCH_STATUS = {"create": 201, "update": 200, "delete": 204}
+BATCH_OPERATIONS = tuple(BATCH_STATUS)
+
+
+######################################################################
+#  K E Y S E T   C U R S O R S
+######################################################################
+def encode_cursor(resource) -> str:
+    """Encodes the (created_date, id) position of a row as an opaque cursor"""
+    raw = f"{resource.created_date.isoformat()}|{resource.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decodes a cursor made by encode_cursor() into a (created_date, id) tuple"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_date, by_id = raw.split("|")
+        return date.fromisoformat(created_date), int(by_id)
+    except (binascii.Error, UnicodeError, ValueError) as error:
+        raise DataValidationError(f"Invalid cursor: {cursor}") from error
+
+
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
@@ -32,6 +107,9 @@ class PersistentBase:
     Base class for persistent models
     """
 
+    # Whether find() and pages of all() are served through the cache
+    cacheable = False
+
     def __init__(self):
         self.id = None  # pylint: disable=invalid-name
 
@@ -43,6 +121,9 @@ class PersistentBase:
     def deserialize(self, data: dict) -> None:
         """Convert a dictionary into an object"""
 
+    def touch(self):
+        """Bumps the version of whatever this change makes stale (nothing by default)"""
+
     def create(self):
         """
         Creates a Wishlist to the database
@@ -51,42 +132,213 @@ class PersistentBase:
         self.id = None  # pylint: disable=invalid-name
         # id must be none to generate next primary key
         db.session.add(self)
+        self.touch()
         db.session.commit()
 
-    def update(self):
+    def update(self, expected_version: int = None):
         """
         Updates a Wishlist to the database
+
+        Args:
+            expected_version (int): when given, only update if the row in the
+                database still has this version, else raise VersionConflictError
         """
         logger.info("Updating %s", self.id)
+        if expected_version is not None:
+            self.check_version(expected_version)
+        if db.session.is_modified(self):
+            self.touch()
         db.session.commit()
 
     def delete(self):
         """Removes a Wishlist from the data store"""
         logger.info("Deleting %s", self.id)
+        self.touch()
         db.session.delete(self)
         db.session.commit()
 
+    def check_version(self, expected_version: int):
+        """Locks the row and raises VersionConflictError if its version moved on"""
+        cls = type(self)
+        by_id = db.inspect(self).identity[0]
+        with db.session.no_autoflush:
+            current = db.session.scalar(
+                db.select(cls.version).where(cls.id == by_id).with_for_update()
+            )
+        if current != expected_version:
+            db.session.rollback()
+            raise VersionConflictError(
+                f"{cls.__name__} {self.id} is at version {current}, not {expected_version}"
+            )
+
+    def column_values(self, with_id: bool = False) -> dict:
+        """Returns the column values of a row, without its id unless asked"""
+        return {
+            column.key: getattr(self, column.key)
+            for column in self.__table__.columns
+            if with_id or column.key != "id"
+        }
+
+    def serialize_columns(self, fields) -> dict:
+        """Returns only the named columns, with dates in ISO 8601, as a dictionary"""
+        data = {}
+        for name in fields:
+            value = getattr(self, name)
+            data[name] = value.isoformat() if isinstance(value, date) else value
+        return data
+
+    @classmethod
+    def from_cache(cls, values: dict):
+        """Rebuilds a row from cached column values without querying it"""
+        resource = cls(**values)
+        make_transient_to_detached(resource)
+        return db.session.merge(resource, load=False)
+
     @classmethod
     def init_db(cls, app):
         """Initializes the database session"""
         logger.info("Initializing database")
         cls.app = app
-        # This is where we initialize SQLAlchemy from the Flask app
+        cache.init_app(app)
+        # This is where we initialize SQLAlchemy from the Flask app. The
+        # engine connects on first use; `flask db-check --create` makes the tables
         db.init_app(app)
-        app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        with app.app_context():
+            retry_connections(
+                db.engine,
+                tries=app.config.get("DB_CONNECT_TRIES", 4),
+                delay=app.config.get("DB_CONNECT_DELAY", 0.25),
+                max_delay=app.config.get("DB_CONNECT_MAX_DELAY", 4.0),
+            )
+            replicas.retry_after = app.config.get("DATABASE_REPLICA_RETRY", 30.0)
+            for key in app.config.get("SQLALCHEMY_BINDS", {}):
+                if key.startswith("replica"):
+                    replicas.add(db.engines[key])
+        init_replicas(app, replicas)
+
+    @classmethod
+    def paginate(cls, query, limit: int = None, after: str = None):
+        """Applies keyset pagination ordered by (created_date, id) to a query
+
+        :param query: the query to page through
+        :param limit: the maximum number of rows to return (all rows if None)
+        :param after: a cursor from encode_cursor() to resume after
+
+        :return: the query ordered, filtered and limited for the page
+        """
+        if limit is None and after is None:
+            return query
+        query = query.order_by(cls.created_date, cls.id)
+        if after:
+            query = query.filter(db.tuple_(cls.created_date, cls.id) > decode_cursor(after))
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    @classmethod
+    def fetch(cls, query, yield_per: int = None, cache_args: tuple = None):
+        """Runs a query and returns its rows
+
+        :param query: the query to run
+        :param yield_per: when set, the rows are streamed from a server-side
+            cursor this many at a time instead of being loaded into a list
+        :param cache_args: when set, the rows are read through the cache
+            under a key made from these arguments
+
+        :return: a list of rows, or an iterator of rows when streaming
+        """
+        if yield_per:
+            return query.yield_per(yield_per)
+        if not (cache_args and cls.cacheable) or bypass_cache():
+            return query.all()
+        key = cache.list_key(cls.__table__.name, *cache_args)
+        rows = cache.get(key)
+        if rows is not None:
+            return [cls.from_cache(values) for values in rows]
+        rows = query.all()
+        cache.set(key, [row.column_values(with_id=True) for row in rows])
+        return rows
+
+    @classmethod
+    def eager(cls, query, embed=()):
+        """Loads the named relationships of the rows of a query up front
+
+        Each relationship is loaded with one extra SELECT ... IN query for
+        the whole result, rather than one lazy query per row.
+        """
+        for name in embed:
+            query = query.options(db.selectinload(getattr(cls, name)))
+        return query
+
+    @classmethod
+    def project(cls, query, fields=()):
+        """Loads only the named columns of the rows of a query
+
+        The primary key and created_date, which page cursors are made of,
+        are always loaded. Any other column is loaded with its own SELECT
+        if it is read later, so serialize only these fields.
+        """
+        if fields:
+            names = set(fields) | {"created_date"}
+            query = query.options(db.load_only(*[getattr(cls, name) for name in names]))
+        return query
+
+    @classmethod
+    def column_names(cls) -> list:
+        """Returns the names of the columns a request may project"""
+        return [column.key for column in cls.__table__.columns]
 
     @classmethod
-    def all(cls):
+    def all(  # pylint: disable=too-many-arguments
+        cls,
+        limit: int = None,
+        after: str = None,
+        yield_per: int = None,
+        embed=(),
+        fields=(),
+    ):
         """Returns all of the Wishlists in the database"""
         logger.info("Processing all Wishlists")
-        return cls.query.all()
+        query = cls.eager(cls.paginate(cls.query, limit, after), embed)
+        query = cls.project(query, fields)
+        # only bounded pages of whole rows without embedded relationships are cached
+        cache_args = ("all", limit, after) if limit and not (embed or fields) else None
+        return cls.fetch(query, yield_per, cache_args)
 
     @classmethod
-    def find(cls, by_id):
+    def find_many(cls, ids, embed=(), fields=()) -> list:
+        """Finds the rows with the given ids in one WHERE id IN (...) query
+
+        :param ids: the ids to look up
+        :param embed: names of relationships to load with the rows
+        :param fields: names of the only columns to load (all if empty)
+
+        :return: the rows that exist, in the order their ids were given
+        :rtype: list
+        """
+        logger.info("Processing lookup for %d ids ...", len(ids))
+        query = cls.project(cls.eager(cls.query.filter(cls.id.in_(ids)), embed), fields)
+        found = {row.id: row for row in query}
+        return [found[by_id] for by_id in dict.fromkeys(ids) if by_id in found]
+
+    @classmethod
+    def find(cls, by_id, embed=()):
         """Finds a Wishlist by it's ID"""
         logger.info("Processing lookup for id %s ...", by_id)
-        return cls.query.get(by_id)
+        try:
+            by_id = int(by_id)  # "05" and 5 must share one cache key
+        except (TypeError, ValueError):
+            return None
+        if embed or not cls.cacheable or bypass_cache():
+            return cls.eager(cls.query, embed).get(by_id)
+        key = cache.row_key(cls.__table__.name, by_id)
+        values = cache.get(key)
+        if values is not None:
+            return cls.from_cache(values)
+        found = cls.query.get(by_id)
+        if found:
+            cache.set(key, found.column_values(with_id=True))
+        return found
 
 
 ######################################################################
@@ -98,27 +350,168 @@ class Wishlist(db.Model, PersistentBase):
     """
 
     app = None
+    cacheable = True
+
+    # Indexes backing keyset pagination and the customer-id filter
+    __table_args__ = (
+        db.Index("ix_wishlist_created_date_id", "created_date", "id"),
+        db.Index(
+            "ix_wishlist_customer_id_created_date_id",
+            "customer_id",
+            "created_date",
+            "id",
+        ),
+    )
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer)
     wishlist_name = db.Column(db.String(64))  # e.g., work, home, vacation, etc.
     is_public = db.Column(db.Boolean, default=False)
-    items = db.relationship("WishlistItem", backref="wishlist", passive_deletes=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    items = db.relationship(
+        "WishlistItem",
+        backref="wishlist",
+        passive_deletes=True,
+        order_by="WishlistItem.id",
+    )
     created_date = db.Column(db.Date(), nullable=False, default=date.today())
 
+    # Only loaded by summarize(), else None
+    item_count = db.query_expression()
+    total_value = db.query_expression()
+
     def __repr__(self):
         return f"<wishlist_id=[{self.id}]>"
 
-    def serialize(self):
-        """Converts an Wishlist into a dictionary"""
-        wishlist = {
-            "id": self.id,
-            "customer_id": self.customer_id,
-            "wishlist_name": self.wishlist_name,
-            "is_public": self.is_public,
-            "created_date": self.created_date.isoformat(),
-        }
+    def touch(self):
+        """Bumps the version of this Wishlist when it is changed"""
+        if self.id is not None:
+            self.version = Wishlist.version + 1
+
+    def clone(self, wishlist_name: str = None, customer_id: int = None) -> int:
+        """Copies this Wishlist and all of its Items in one transaction
+
+        The copy is made by the database with one INSERT ... SELECT for the
+        Wishlist and one for its Items, so it takes the same number of round
+        trips however many Items there are.
+
+        :param wishlist_name: name of the copy (the same name if None)
+        :type wishlist_name: str
+        :param customer_id: owner of the copy (the same owner if None)
+        :type customer_id: int
+
+        :return: the id of the new Wishlist
+        :rtype: int
+
+        """
+        if wishlist_name is not None and not isinstance(wishlist_name, str):
+            raise DataValidationError("Invalid type for str [wishlist_name]: " + str(type(wishlist_name)))
+        if customer_id is not None and (not isinstance(customer_id, int) or isinstance(customer_id, bool)):
+            raise DataValidationError("Invalid type for int [customer_id]: " + str(type(customer_id)))
+        logger.info("Cloning %s", self.id)
+        today = db.literal(date.today(), db.Date)
+        new_id = db.session.execute(
+            db.insert(Wishlist)
+            .from_select(
+                ["customer_id", "wishlist_name", "is_public", "created_date"],
+                db.select(
+                    Wishlist.customer_id if customer_id is None else db.literal(customer_id, db.Integer),
+                    Wishlist.wishlist_name if wishlist_name is None else db.literal(wishlist_name, db.String),
+                    Wishlist.is_public,
+                    today,
+                ).where(Wishlist.id == self.id),
+            )
+            .returning(Wishlist.id)
+        ).scalar_one()
+        db.session.execute(
+            db.insert(WishlistItem).from_select(
+                ["wishlist_id", "product_id", "product_name", "product_price", "quantity", "created_date"],
+                db.select(
+                    db.literal(new_id, db.Integer),
+                    WishlistItem.product_id,
+                    WishlistItem.product_name,
+                    WishlistItem.product_price,
+                    WishlistItem.quantity,
+                    today,
+                )
+                .where(WishlistItem.wishlist_id == self.id)
+                .order_by(WishlistItem.id),
+            )
+        )
+        db.session.commit()
+        return new_id
+
+    @classmethod
+    def touch_ids(cls, ids):
+        """Bumps the versions of the Wishlists whose items were changed"""
+        ids = {by_id for by_id in ids if by_id is not None}
+        if not ids:
+            return
+        table = cls.__table__
+        db.session.connection().execute(
+            table.update().where(table.c.id.in_(ids)).values(version=table.c.version + 1)
+        )
+        pending_invalidations(db.session, table.name)["ids"].update(ids)
+        for resource in list(db.session.identity_map.values()):
+            if isinstance(resource, cls) and resource.id in ids:
+                db.session.expire(resource, ["version"])
+
+    @classmethod
+    def eager(cls, query, embed=()):
+        """Loads the named relationships, and the item summary for "summary" """
+        query = super().eager(query, [name for name in embed if name != "summary"])
+        if "summary" in embed:
+            query = cls.summarize(query)
+        return query
+
+    @classmethod
+    def summarize(cls, query):
+        """Loads the item_count and total_value of each Wishlist of a query
+
+        Both are aggregated by the database in the same SELECT, with
+        subqueries correlated to each Wishlist that use the wishlist_id
+        index, so no WishlistItem rows are loaded and only the items of the
+        Wishlists on the page are read.
+        """
+        items = WishlistItem.__table__
+        of_wishlist = items.c.wishlist_id == cls.id
+        item_count = db.select(db.func.count()).where(of_wishlist).scalar_subquery()
+        total_value = (
+            db.select(db.func.coalesce(db.func.sum(items.c.product_price * items.c.quantity), 0))
+            .where(of_wishlist)
+            .scalar_subquery()
+        )
+        return query.options(
+            db.with_expression(cls.item_count, item_count),
+            db.with_expression(cls.total_value, total_value),
+        )
+
+    @timed("serialize")
+    def serialize(self, embed=(), fields=()):
+        """Converts an Wishlist into a dictionary
+
+        Args:
+            embed (tuple): include the Wishlist's items when it holds "items",
+                and its item_count and total_value when it holds "summary"
+            fields (tuple): only include these columns (all if empty)
+        """
+        if fields:
+            wishlist = self.serialize_columns(fields)
+        else:
+            wishlist = {
+                "id": self.id,
+                "customer_id": self.customer_id,
+                "wishlist_name": self.wishlist_name,
+                "is_public": self.is_public,
+                "created_date": self.created_date.isoformat(),
+                "version": self.version,
+            }
+        if "items" in embed:
+            wishlist["wishlist_items"] = [item.serialize() for item in self.items]
+        if "summary" in embed:
+            wishlist["item_count"] = self.item_count
+            wishlist["total_value"] = self.total_value
         return wishlist
 
     def deserialize(self, data):
@@ -145,18 +538,40 @@ class Wishlist(db.Model, PersistentBase):
         return self
 
     @classmethod
-    def find_by_customer_id(cls, customer_id: int) -> list:
+    def find_by_customer_id(  # pylint: disable=too-many-arguments
+        cls,
+        customer_id: int,
+        limit: int = None,
+        after: str = None,
+        yield_per: int = None,
+        embed=(),
+        fields=(),
+    ) -> list:
         """Returns all wishlists for a given customer id
 
         :param customer_id: customer id of customer who owns the list
         :type customer_id: int
+        :param limit: maximum number of wishlists to return (all if None)
+        :type limit: int
+        :param after: cursor of the last wishlist of the previous page
+        :type after: str
+        :param yield_per: stream the wishlists this many at a time
+        :type yield_per: int
+        :param embed: names of relationships to load with the wishlists
+        :type embed: tuple
+        :param fields: names of the only columns to load (all if empty)
+        :type fields: tuple
 
-        :return: a collection of wishlists (or empty list)
+        :return: a collection of wishlists (or empty list), or an
+            iterator of wishlists when yield_per is set
         :rtype: list
 
         """
         logger.info("Querying wishlists for customer id: [%s]", customer_id)
-        return cls.query.filter(cls.customer_id == customer_id).all()
+        query = cls.query.filter(cls.customer_id == customer_id)
+        query = cls.project(cls.eager(cls.paginate(query, limit, after), embed), fields)
+        cache_args = ("customer", customer_id, limit, after) if limit and not (embed or fields) else None
+        return cls.fetch(query, yield_per, cache_args)
 
 
 ######################################################################
@@ -167,6 +582,22 @@ class WishlistItem(db.Model, PersistentBase):
 
     __tablename__ = "wishlist_items"
 
+    # Indexes backing the item lookups and the item list filters
+    __table_args__ = (
+        # a product is in a wishlist at most once; upsert() merges into it
+        db.Index(
+            "uq_wishlist_items_wishlist_id_product_id",
+            "wishlist_id",
+            "product_id",
+            unique=True,
+        ),
+        db.Index(
+            "ix_wishlist_items_wishlist_id_created_date", "wishlist_id", "created_date"
+        ),
+        # price updates find the Items of a product across every wishlist
+        db.Index("ix_wishlist_items_product_id", "product_id"),
+    )
+
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
     wishlist_id = db.Column(
@@ -193,7 +624,11 @@ class WishlistItem(db.Model, PersistentBase):
             f")"
         )
 
-    def serialize(self):
+    @timed("serialize")
+    def serialize(self, fields=()):
+        """Converts an Item into a dictionary, with only the given columns if any"""
+        if fields:
+            return self.serialize_columns(fields)
         return {
             "id": self.id,
             "wishlist_id": self.wishlist_id,
@@ -222,3 +657,555 @@ class WishlistItem(db.Model, PersistentBase):
                 "bad or no data - " + error.args[0]
             ) from error
         return self
+
+    @classmethod
+    def deserialize_operation(cls, index: int, data: dict) -> tuple:
+        """
+        Converts one entry of a batch into an (op, item_id, item) tuple
+
+        Args:
+            index (int): the position of the entry in the batch
+            data (dict): {"op": "create" | "update" | "delete", "id": ..., "item": {...}}
+        """
+        try:
+            operation = data["op"]
+            if operation not in BATCH_OPERATIONS:
+                raise DataValidationError(
+                    f"Invalid operation {index}: op must be one of {', '.join(BATCH_OPERATIONS)}"
+                )
+            item_id = None if operation == "create" else int(data["id"])
+            item = None
+            if operation != "delete":
+                item = cls().deserialize(dict(data["item"], wishlist_id=0))
+                item.id = item_id
+                # checked here, as a bad value would fail the whole INSERT
+                item.product_id = int(item.product_id)
+                item.quantity = int(item.quantity)
+                item.product_price = Decimal(str(item.product_price))
+                if not isinstance(item.product_name, str):
+                    raise TypeError("product_name must be a string")
+        except KeyError as error:
+            raise DataValidationError(
+                f"Invalid operation {index}: missing " + error.args[0]
+            ) from error
+        except (TypeError, ValueError, InvalidOperation) as error:
+            raise DataValidationError(
+                f"Invalid operation {index}: bad or no data - {error}"
+            ) from error
+        return operation, item_id, item
+
+    @classmethod
+    def apply_batch(cls, wishlist_id: int, data: list) -> list:
+        """Applies a batch of Item operations to a Wishlist in one transaction
+
+        All creates are written with one multi-row INSERT, all updates with
+        one executemany UPDATE and all deletes with one DELETE. Updates and
+        deletes of Items that are not in the Wishlist are skipped.
+
+        :param wishlist_id: id of the Wishlist that holds the Items
+        :type wishlist_id: int
+        :param data: the operations, see deserialize_operation()
+        :type data: list
+
+        :return: one {"op", "id", "status", "item"} result per operation
+        :rtype: list
+
+        """
+        operations = [
+            cls.deserialize_operation(index, entry) for index, entry in enumerate(data)
+        ]
+        logger.info("Applying %d item operations to wishlist %s", len(operations), wishlist_id)
+        for _, _, item in operations:
+            if item:
+                item.wishlist_id = wishlist_id
+
+        ids = {item_id for operation, item_id, _ in operations if operation != "create"}
+        found = set(
+            db.session.scalars(
+                db.select(cls.id).where(cls.wishlist_id == wishlist_id, cls.id.in_(ids))
+            )
+        )
+        if found or any(operation == "create" for operation, _, _ in operations):
+            Wishlist.touch_ids([wishlist_id])
+        cls.write_batch(
+            [item for operation, _, item in operations if operation == "create"],
+            [item for operation, item_id, item in operations if operation == "update" and item_id in found],
+            [item_id for operation, item_id, _ in operations if operation == "delete" and item_id in found],
+        )
+
+        results = []
+        for operation, item_id, item in operations:
+            applied = operation == "create" or item_id in found
+            results.append(
+                {
+                    "op": operation,
+                    "id": item.id if item else item_id,
+                    "status": BATCH_STATUS[operation] if applied else 404,
+                    "item": item.serialize() if item and applied else None,
+                }
+            )
+        return results
+
+    @classmethod
+    def write_batch(cls, creates: list, updates: list, deletes: list):
+        """Writes new Items, changed Items and deleted Item ids in one commit"""
+        if creates:
+            # RETURNING rows come back in no set order, so each id is matched
+            # to its Item by the (wishlist_id, product_id) pair it is unique on
+            rows = db.session.execute(
+                db.insert(cls)
+                .values([item.column_values() for item in creates])
+                .returning(cls.id, cls.wishlist_id, cls.product_id)
+            ).all()
+            new_ids = {(row.wishlist_id, row.product_id): row.id for row in rows}
+            for item in creates:
+                item.id = new_ids[item.wishlist_id, item.product_id]
+        if updates:
+            db.session.execute(
+                db.update(cls), [dict(item.column_values(), id=item.id) for item in updates]
+            )
+        if deletes:
+            db.session.execute(db.delete(cls).where(cls.id.in_(deletes)))
+        db.session.commit()
+
+    def touch(self):
+        """Bumps the version of the Wishlist that holds this Item"""
+        wishlist_id = self.wishlist_id
+        if wishlist_id is None and self.wishlist is not None:
+            wishlist_id = self.wishlist.id
+        Wishlist.touch_ids([wishlist_id])
+
+    def upsert(self) -> bool:
+        """Inserts this Item, or adds its quantity to the Item already there
+
+        Runs INSERT ... ON CONFLICT (wishlist_id, product_id) DO UPDATE, so
+        two requests adding the same product at once still end up with one
+        Item holding both quantities. The Item's id is set either way.
+
+        :return: True if a new Item was inserted, False if one was merged into
+        :rtype: bool
+
+        """
+        logger.info("Upserting product %s into wishlist %s", self.product_id, self.wishlist_id)
+        dialect = db.engine.dialect.name
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        table = type(self).__table__
+        upsert = insert(table).values(**self.column_values())
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[table.c.wishlist_id, table.c.product_id],
+            set_={"quantity": table.c.quantity + upsert.excluded.quantity},
+        )
+        if dialect == "postgresql":
+            # PostgreSQL leaves xmax at 0 on freshly inserted rows
+            inserted = db.literal_column("xmax = 0")
+        else:
+            # SQLite has no xmax, but runs one writer at a time, so the row
+            # seen in this transaction is the one the upsert will find
+            existing = db.session.execute(
+                db.select(table.c.id).where(
+                    table.c.wishlist_id == self.wishlist_id, table.c.product_id == self.product_id
+                )
+            ).first()
+            inserted = db.literal(existing is None)
+        self.id, created = db.session.execute(
+            upsert.returning(table.c.id, inserted)
+        ).one()
+        Wishlist.touch_ids([self.wishlist_id])
+        db.session.commit()
+        return created
+
+    @classmethod
+    def dedupe(cls, batch_size: int = 1000) -> int:
+        """Merges one batch of Items that hold the same product in a wishlist
+
+        The Item with the lowest id of each duplicate group keeps the summed
+        quantity and the others are deleted, all in one transaction.
+
+        :param batch_size: most duplicate groups to merge
+        :type batch_size: int
+
+        :return: the number of groups merged, 0 once none are left
+        :rtype: int
+
+        """
+        groups = db.session.execute(
+            db.select(
+                cls.wishlist_id,
+                cls.product_id,
+                db.func.min(cls.id),
+                db.func.sum(cls.quantity),
+            )
+            .group_by(cls.wishlist_id, cls.product_id)
+            .having(db.func.count() > 1)
+            .limit(batch_size)
+        ).all()
+        if not groups:
+            return 0
+        keepers = [keep for _, _, keep, _ in groups]
+        db.session.execute(
+            db.update(cls), [{"id": keep, "quantity": total} for _, _, keep, total in groups]
+        )
+        db.session.execute(
+            db.delete(cls)
+            .where(
+                db.tuple_(cls.wishlist_id, cls.product_id).in_(
+                    [(wishlist_id, product_id) for wishlist_id, product_id, _, _ in groups]
+                ),
+                cls.id.not_in(keepers),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        Wishlist.touch_ids({wishlist_id for wishlist_id, _, _, _ in groups})
+        db.session.commit()
+        return len(groups)
+
+    @classmethod
+    def deserialize_prices(cls, data) -> dict:
+        """
+        Converts new product prices into a {product_id: price} dict
+
+        Args:
+            data (iterable): [{"product_id": ..., "product_price": ...}], where a
+                product listed twice takes its last price
+        """
+        prices = {}
+        for index, entry in enumerate(data):
+            try:
+                price = Decimal(str(entry["product_price"]))
+                if not price.is_finite() or price < 0:
+                    raise ValueError(f"product_price must be a number of 0 or more, not {price}")
+                prices[int(entry["product_id"])] = price
+            except KeyError as error:
+                raise DataValidationError(
+                    f"Invalid price {index}: missing " + error.args[0]
+                ) from error
+            except (TypeError, ValueError, InvalidOperation) as error:
+                raise DataValidationError(
+                    f"Invalid price {index}: bad or no data - {error}"
+                ) from error
+        return prices
+
+    @classmethod
+    def update_prices(cls, prices: dict, chunk_size: int = 1000, max_rows: int = 10000, progress=None) -> int:
+        """Sets the product_price of every Item of the given products
+
+        Each chunk of products is written with one set-based UPDATE whose
+        new prices come from a VALUES list. An UPDATE changes at most
+        max_rows Items and is committed right away, so no transaction holds
+        many row locks; it is repeated until the chunk has no stale Items.
+
+        :param prices: the new price of each product_id
+        :type prices: dict
+        :param chunk_size: most products per UPDATE
+        :type chunk_size: int
+        :param max_rows: most Items changed per transaction
+        :type max_rows: int
+        :param progress: called as progress(products_done, products, items_updated)
+            after each transaction
+
+        :return: the number of Items whose price changed
+        :rtype: int
+
+        """
+        pairs = list(prices.items())
+        logger.info("Updating the prices of %d products", len(pairs))
+        updated = 0
+        for start in range(0, len(pairs), chunk_size):
+            chunk = pairs[start:start + chunk_size]
+            while True:
+                wishlist_ids = db.session.scalars(cls.price_update(chunk, max_rows)).all()
+                Wishlist.touch_ids(wishlist_ids)
+                db.session.commit()
+                updated += len(wishlist_ids)
+                if progress:
+                    progress(start + len(chunk), len(pairs), updated)
+                if len(wishlist_ids) < max_rows:
+                    break
+        return updated
+
+    @classmethod
+    def price_update(cls, pairs: list, max_rows: int):
+        """Returns the UPDATE that sets the prices of up to max_rows stale Items
+
+        WITH stale AS (SELECT id, price FROM wishlist_items JOIN (VALUES ...)
+        prices ... WHERE product_price IS DISTINCT FROM price LIMIT max_rows)
+        UPDATE wishlist_items SET product_price = stale.price FROM stale
+        WHERE wishlist_items.id = stale.id RETURNING wishlist_id
+        """
+        prices = db.values(
+            db.column("product_id", db.Integer),
+            db.column("price", db.Numeric),
+            name="prices",
+        ).data(pairs)
+        stale = (
+            db.select(cls.id, prices.c.price)
+            .join(prices, cls.product_id == prices.c.product_id)
+            .where(cls.product_price.is_distinct_from(prices.c.price))
+            .limit(max_rows)
+            .cte("stale")
+        )
+        return (
+            db.update(cls)
+            .where(cls.id == stale.c.id)
+            .values(product_price=stale.c.price)
+            .returning(cls.wishlist_id)
+            .execution_options(synchronize_session=False)
+        )
+
+    @classmethod
+    def find_in_wishlist(cls, wishlist_id: int, item_id: int):
+        """Finds an Item by its ID within a given Wishlist
+
+        :param wishlist_id: id of the Wishlist that holds the Item
+        :type wishlist_id: int
+        :param item_id: id of the Item to look up
+        :type item_id: int
+
+        :return: the Item, or None if the Wishlist has no such Item
+        :rtype: WishlistItem
+
+        """
+        logger.info("Processing lookup for item %s in wishlist %s ...", item_id, wishlist_id)
+        return cls.query.filter(cls.wishlist_id == wishlist_id, cls.id == item_id).first()
+
+    @classmethod
+    def search(cls, query, term: str):
+        """Filters a query to the Items whose product_name matches a search
+
+        Every word of the search must prefix a word of the product_name.
+        On PostgreSQL this uses the full text index on product_name and on
+        SQLite the wishlist_items_fts FTS5 table. Best matches come first.
+
+        :param query: the Item query to filter
+        :param term: the words to search for
+
+        :return: the query filtered and ordered by relevance
+        """
+        logger.info("Processing search for items matching '%s'", term)
+        words = re.findall(r"\w+", term or "")
+        if not words:
+            raise DataValidationError(f"Invalid search: '{term}' has no words")
+        if db.engine.dialect.name == "sqlite":
+            fts = db.table("wishlist_items_fts", db.column("rowid"), db.column("rank"))
+            match = " ".join(f'"{word}"*' for word in words)
+            return (
+                query.join(fts, fts.c.rowid == cls.id)
+                .filter(db.text("wishlist_items_fts MATCH :match").bindparams(match=match))
+                .order_by(fts.c.rank, cls.id)
+            )
+        tsquery = postgresql.to_tsquery(
+            SEARCH_CONFIG, " & ".join(f"{word}:*" for word in words)
+        )
+        return query.filter(PRODUCT_NAME_TSVECTOR.bool_op("@@")(tsquery)).order_by(
+            db.func.ts_rank(PRODUCT_NAME_TSVECTOR, tsquery).desc(), cls.id
+        )
+
+
+######################################################################
+# IDEMPOTENCY KEY MODEL
+######################################################################
+class IdempotencyKey(db.Model):
+    """The response to a POST sent with an Idempotency-Key header
+
+    A row is claimed, with no response yet, before the request runs, so a
+    retry with the same key finds it instead of running the request again.
+    The response is stored once the request succeeds, and replayed to the
+    retries that come after it.
+    """
+
+    __tablename__ = "idempotency_keys"
+    cacheable = False
+
+    # Table Schema
+    key = db.Column(db.String(255), primary_key=True)
+    path = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # SHA-256 of the body
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    status_code = db.Column(db.Integer)  # None while the request runs
+    headers = db.Column(db.JSON)
+    body = db.Column(db.LargeBinary)
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.key} {self.path} status_code=[{self.status_code}]>"
+
+    @classmethod
+    def claim(  # pylint: disable=too-many-arguments
+        cls, key: str, path: str, fingerprint: str, ttl: int, lock_timeout: int
+    ):
+        """Claims a key for the current request, in a transaction of its own
+
+        Runs INSERT ... ON CONFLICT DO NOTHING, so of two requests with the
+        same key only one claims it. A key older than ttl seconds, or claimed
+        by a request that didn't finish within lock_timeout seconds, is taken
+        over as if it were new.
+
+        :param key: the Idempotency-Key header
+        :param path: the path of the request
+        :param fingerprint: the SHA-256 of the request body
+        :param ttl: seconds a response is replayed for
+        :param lock_timeout: seconds after which an unfinished claim is abandoned
+
+        :return: None once claimed, else the earlier request holding the key
+        :rtype: IdempotencyKey
+
+        """
+        logger.info("Claiming idempotency key %s for %s", key, path)
+        now = datetime.utcnow()
+        table = cls.__table__
+        values = {
+            "key": key,
+            "path": path,
+            "fingerprint": fingerprint,
+            "created_at": now,
+            "status_code": None,
+            "headers": None,
+            "body": None,
+        }
+        insert = postgresql.insert if db.engine.dialect.name == "postgresql" else sqlite.insert
+        while True:
+            claimed = db.session.execute(
+                insert(table).values(**values).on_conflict_do_nothing().returning(table.c.key)
+            ).first()
+            if not claimed:
+                expired = db.or_(
+                    table.c.created_at < now - timedelta(seconds=ttl),
+                    db.and_(
+                        table.c.status_code.is_(None),
+                        table.c.created_at < now - timedelta(seconds=lock_timeout),
+                    ),
+                )
+                claimed = db.session.execute(
+                    table.update().where(table.c.key == key, expired).values(**values).returning(table.c.key)
+                ).first()
+            db.session.commit()
+            if claimed:
+                return None
+            earlier = db.session.execute(
+                db.select(cls).where(cls.key == key).execution_options(populate_existing=True)
+            ).scalar()
+            if earlier is not None:
+                return earlier
+            # the earlier request released the key in the meantime, so try again
+
+    @classmethod
+    def complete(cls, key: str, response):
+        """Stores the response of the request that claimed a key
+
+        :param key: the claimed Idempotency-Key
+        :param response: the response to replay to retries
+        :type response: flask.Response
+
+        """
+        logger.info("Storing the %s response of idempotency key %s", response.status_code, key)
+        headers = {name: value for name, value in response.headers.items() if name != "Content-Length"}
+        db.session.execute(
+            cls.__table__.update()
+            .where(cls.key == key)
+            .values(status_code=response.status_code, headers=headers, body=response.get_data())
+        )
+        db.session.commit()
+
+    @classmethod
+    def release(cls, key: str):
+        """Frees a key whose request failed, so a retry runs it again"""
+        logger.info("Releasing idempotency key %s", key)
+        db.session.rollback()
+        db.session.execute(
+            cls.__table__.delete().where(cls.key == key, cls.status_code.is_(None))
+        )
+        db.session.commit()
+
+    @classmethod
+    def purge(cls, ttl: int) -> int:
+        """Deletes the keys older than ttl seconds
+
+        :param ttl: seconds a response is replayed for
+
+        :return: the number of keys deleted
+        :rtype: int
+
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=ttl)
+        deleted = db.session.execute(
+            cls.__table__.delete().where(cls.created_at < cutoff)
+        ).rowcount
+        db.session.commit()
+        logger.info("Purged %s idempotency keys created before %s", deleted, cutoff)
+        return deleted
+
+
+######################################################################
+# CACHE INVALIDATION
+######################################################################
+def pending_invalidations(session, table: str) -> dict:
+    """Returns the rows of a table to forget when the session commits"""
+    pending = session.info.setdefault("cache_invalidations", {})
+    return pending.setdefault(table, {"ids": set(), "bulk": False})
+
+
+@event.listens_for(Session, "after_flush")
+def collect_flushed_rows(session, _flush_context):
+    """Remembers the cacheable rows written by a flush"""
+    for resource in chain(session.new, session.dirty, session.deleted):
+        if resource.cacheable:
+            pending_invalidations(session, resource.__table__.name)["ids"].add(resource.id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def collect_bulk_statements(orm_execute_state):
+    """Remembers the cacheable tables written by bulk INSERT/UPDATE/DELETE"""
+    mapper = orm_execute_state.bind_mapper
+    if orm_execute_state.is_select or mapper is None or not mapper.class_.cacheable:
+        return
+    pending = pending_invalidations(orm_execute_state.session, mapper.local_table.name)
+    pending["bulk"] = pending["bulk"] or not orm_execute_state.is_insert
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_committed_rows(session):
+    """Forgets the cached rows written by a committed transaction"""
+    for table, pending in session.info.pop("cache_invalidations", {}).items():
+        cache.invalidate(table, pending["ids"], pending["bulk"])
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_invalidations(session):
+    """Nothing was written, so nothing needs to be forgotten"""
+    session.info.pop("cache_invalidations", None)
+
+
+######################################################################
+# PRODUCT NAME SEARCH INDEXES
+######################################################################
+SEARCH_CONFIG = db.text("'simple'")
+PRODUCT_NAME_TSVECTOR = postgresql.to_tsvector(SEARCH_CONFIG, WishlistItem.product_name)
+
+# PostgreSQL: GIN full text index on product_name
+db.Index(
+    "ix_wishlist_items_product_name_tsv",
+    PRODUCT_NAME_TSVECTOR,
+    postgresql_using="gin",
+).ddl_if(dialect="postgresql")
+
+# SQLite: FTS5 table over product_name, kept in step by triggers
+for statement in (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS wishlist_items_fts USING fts5("
+    "product_name, content='wishlist_items', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS wishlist_items_fts_ai AFTER INSERT ON wishlist_items BEGIN "
+    "INSERT INTO wishlist_items_fts(rowid, product_name) VALUES (new.id, new.product_name); END",
+    "CREATE TRIGGER IF NOT EXISTS wishlist_items_fts_ad AFTER DELETE ON wishlist_items BEGIN "
+    "INSERT INTO wishlist_items_fts(wishlist_items_fts, rowid, product_name) "
+    "VALUES ('delete', old.id, old.product_name); END",
+    "CREATE TRIGGER IF NOT EXISTS wishlist_items_fts_au AFTER UPDATE ON wishlist_items BEGIN "
+    "INSERT INTO wishlist_items_fts(wishlist_items_fts, rowid, product_name) "
+    "VALUES ('delete', old.id, old.product_name); "
+    "INSERT INTO wishlist_items_fts(rowid, product_name) VALUES (new.id, new.product_name); END",
+):
+    event.listen(
+        WishlistItem.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite")
+    )
+event.listen(
+    WishlistItem.__table__,
+    "after_drop",
+    DDL("DROP TABLE IF EXISTS wishlist_items_fts").execute_if(dialect="sqlite"),
+)
@@ -4,17 +4,40 @@ Wishlist
 The wishlist service allows an eCommerce wishlist admin to view
 and manage customer wishlists.
 """
+# pylint: disable=too-many-lines
 
+import hashlib
 from datetime import datetime
-from flask import jsonify, request, abort, make_response
+from functools import wraps
+from werkzeug.http import quote_etag
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    current_app,
+    jsonify,
+    make_response,
+    request,
+    stream_with_context,
+)
 
 # from flask_restx import Api, Resource
 from flask_restx import fields, reqparse, Resource
+from flask_restx.utils import unpack
 from service.common import status  # HTTP Status Codes
-from service.models import Wishlist, WishlistItem
+from service.common.metrics import export_metrics, timing
+from service.common.pool import pool_stats
+from service.common.serializers import dumps, serializer_for
+from service.models import IdempotencyKey, Wishlist, WishlistItem, cache, db, encode_cursor, replicas
+
+# Import the Api, which create_app() binds to the Flask application
+from . import api
 
-# Import Flask application
-from . import app, api
+# Routes outside the /api prefix
+blueprint = Blueprint("wishlists", __name__)
+
+# Header that makes a retried POST replay the first response, see idempotent()
+IDEMPOTENCY_HEADER = "Idempotency-Key"
 
 # MODELS
 
@@ -70,6 +93,9 @@ create_wishlist_model = api.model(
         "created_date": fields.Date(
             readOnly=False, description="The day the wishlist was created"
         ),
+        "version": fields.Integer(
+            readOnly=True, description="Bumped whenever the wishlist or its items change"
+        ),
     },
 )
 
@@ -88,6 +114,75 @@ wishlist_model = api.inherit(
     },
 )
 
+wishlist_summary_model = api.inherit(
+    "WishlistSummaryModel",
+    wishlist_model,
+    {
+        "item_count": fields.Integer(
+            readOnly=True, description="How many items the wishlist holds, with ?embed=summary"
+        ),
+        "total_value": fields.String(
+            readOnly=True,
+            description="Sum of product_price * quantity of its items, with ?embed=summary",
+        ),
+    },
+)
+
+item_operation_model = api.model(
+    "WishlistItemOperation",
+    {
+        "op": fields.String(
+            required=True,
+            enum=["create", "update", "delete"],
+            description="The operation to apply to the item",
+        ),
+        "id": fields.Integer(
+            required=False, description="The id of the item to update or delete"
+        ),
+        "item": fields.Nested(
+            create_item_model,
+            required=False,
+            description="The item data to create or update",
+        ),
+    },
+)
+
+item_result_model = api.model(
+    "WishlistItemOperationResult",
+    {
+        "op": fields.String(description="The operation that was applied"),
+        "id": fields.Integer(description="The id of the item"),
+        "status": fields.Integer(description="The HTTP status of the operation"),
+        "item": fields.Nested(
+            item_model, allow_null=True, description="The item as written"
+        ),
+    },
+)
+
+price_model = api.model(
+    "ProductPrice",
+    {
+        "product_id": fields.Integer(
+            required=True, description="The ID of the product whose price changed"
+        ),
+        "product_price": fields.String(
+            required=True, description="The new price of the product"
+        ),
+    },
+)
+
+price_result_model = api.model(
+    "ProductPriceResult",
+    {
+        "products": fields.Integer(description="How many products were priced"),
+        "updated": fields.Integer(description="How many Wishlist Items changed price"),
+    },
+)
+
+NDJSON = "application/x-ndjson"
+EMBEDDABLE = ("items",)
+LIST_EMBEDDABLE = EMBEDDABLE + ("summary",)
+
 # Query string arguments
 wishlist_args = reqparse.RequestParser()
 wishlist_args.add_argument(
@@ -97,27 +192,257 @@ wishlist_args.add_argument(
     required=False,
     help="List Wishlists by Owner ID",
 )
+wishlist_args.add_argument(
+    "limit",
+    type=int,
+    location="args",
+    required=False,
+    help="Maximum number of Wishlists to return in one page",
+)
+wishlist_args.add_argument(
+    "embed",
+    type=str,
+    location="args",
+    required=False,
+    help="Set to items to include the items of each Wishlist, and/or to summary "
+    "for their item_count and total_value",
+)
+wishlist_args.add_argument(
+    "after",
+    type=str,
+    location="args",
+    required=False,
+    help="Cursor of the last Wishlist seen, taken from the previous page",
+)
+
+wishlist_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated columns to return, such as id,wishlist_name",
+)
+
+wishlist_args.add_argument(
+    "ids",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated ids of the Wishlists to return in one request",
+)
+
+search_args = reqparse.RequestParser()
+search_args.add_argument(
+    "q",
+    type=str,
+    location="args",
+    required=True,
+    help="Words to search for in product names",
+)
+search_args.add_argument(
+    "customer-id",
+    type=int,
+    location="args",
+    required=False,
+    help="Only search the Wishlists of this Owner ID",
+)
+search_args.add_argument(
+    "limit",
+    type=int,
+    location="args",
+    required=False,
+    help="Maximum number of Items to return",
+)
+
+
+######################################################################
+#  D E C O R A T O R S
+######################################################################
+def marshal_or_response(model, as_list=False, fast=False, summary_model=None, **options):
+    """Works like api.marshal_with() but lets a Response through as-is
+
+    This allows an endpoint to return a streamed Response (such as an
+    NDJSON export) or a bodiless 304 Not Modified while still documenting
+    and marshalling the usual result. The time spent marshalling is
+    reported under "serialize" in the Server-Timing header.
+
+    With fast set, and FAST_JSON configured, the result is converted by the
+    model's compiled serializer and returned as JSON bytes instead, giving
+    the same body as marshalling without walking the fields of every row.
+    A request with an X-Fields mask header is marshalled, which applies it.
+
+    With summary_model set, a request for ?embed=summary is marshalled with
+    that model instead, so only those responses carry its summary fields.
+    """
+
+    def decorator(func):
+        marshal_with = api.marshal_list_with if as_list else api.marshal_with
+        plain = marshal_with(model, **options)(lambda resp: resp), serializer_for(model)
+        summary = plain
+        if summary_model is not None:
+            summary = marshal_with(summary_model, **options)(lambda resp: resp), serializer_for(summary_model)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            resp = func(*args, **kwargs)
+            if isinstance(resp, Response):
+                return resp
+            summarized = "summary" in request.args.get("embed", "").split(",")
+            marshaller, convert = summary if summarized else plain
+            with timing("serialize"):
+                data, code, headers = unpack(resp)
+                if not (fast and current_app.config.get("FAST_JSON")) or masked():
+                    marshalled, code, headers = unpack(marshaller(resp))
+                    return (project(marshalled, data) if as_list else marshalled), code, headers
+                body = dumps(project([convert(row) for row in data], data) if as_list else convert(data))
+            return Response(body, status=code, headers=headers, mimetype="application/json")
+
+        wrapper.__apidoc__ = dict(summary[0].__apidoc__)
+        return wrapper
+
+    return decorator
+
+
+def masked() -> bool:
+    """Returns True when the request asks for a subset of fields in X-Fields"""
+    return bool(request.headers.get(current_app.config.get("RESTX_MASK_HEADER", "X-Fields")))
+
+
+def project(marshalled, data):
+    """Drops the fields a ?fields= projection left out of a list of rows
+
+    Marshalling fills in every field of the model, so without this a
+    projected row would still list the other fields, as nulls.
+    """
+    if "fields" not in request.args:
+        return marshalled
+    return [{key: row[key] for key in source} for row, source in zip(marshalled, data)]
+
+
+def idempotent(func):
+    """Runs a POST once per Idempotency-Key and replays its response to retries
+
+    The first request with a key claims it in the idempotency_keys table
+    before it runs. Its 2xx response is stored and returned again, with an
+    Idempotent-Replayed header, to every retry within IDEMPOTENCY_TTL
+    seconds. A retry that arrives while the first request is still running
+    gets 409 Conflict, and the key reused for another request gets 422. A
+    request that fails releases its key. Requests without the header run
+    as before.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return func(*args, **kwargs)
+        if not 0 < len(key) <= 255:
+            abort(status.HTTP_400_BAD_REQUEST, f"{IDEMPOTENCY_HEADER} must be 1 to 255 characters")
+        fingerprint = request_fingerprint()
+        earlier = IdempotencyKey.claim(
+            key,
+            request.path,
+            fingerprint,
+            current_app.config["IDEMPOTENCY_TTL"],
+            current_app.config["IDEMPOTENCY_LOCK_TIMEOUT"],
+        )
+        if earlier is not None:
+            return replay(earlier, fingerprint)
+        try:
+            resp = func(*args, **kwargs)
+            if not isinstance(resp, Response):
+                resp = api.make_response(*unpack(resp))
+        except Exception:
+            IdempotencyKey.release(key)
+            raise
+        if resp.status_code < 300:
+            IdempotencyKey.complete(key, resp)
+        else:
+            IdempotencyKey.release(key)
+        return resp
+
+    return api.doc(params={IDEMPOTENCY_HEADER: {"in": "header", "description": "Unique key of the request"}})(
+        api.response(status.HTTP_422_UNPROCESSABLE_ENTITY, "The Idempotency-Key was used for another request")(wrapper)
+    )
+
+
+def request_fingerprint() -> str:
+    """Returns a hash of the method, path, query string and body of the request"""
+    digest = hashlib.sha256(f"{request.method} {request.full_path}\n".encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def replay(earlier, fingerprint):
+    """Returns the stored response of the request that claimed a key first"""
+    if earlier.path != request.path or earlier.fingerprint != fingerprint:
+        abort(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            f"{IDEMPOTENCY_HEADER} {earlier.key} was already used for another request",
+        )
+    if earlier.status_code is None:
+        abort(
+            status.HTTP_409_CONFLICT,
+            f"A request with {IDEMPOTENCY_HEADER} {earlier.key} is still in progress",
+        )
+    current_app.logger.info("Replaying the response of %s %s", IDEMPOTENCY_HEADER, earlier.key)
+    headers = dict(earlier.headers or {}, **{"Idempotent-Replayed": "true"})
+    return Response(earlier.body, status=earlier.status_code, headers=headers)
 
 
 ######################################################################
 # GET INDEX
 ######################################################################
-@app.route("/")
+@blueprint.route("/")
 def index():
     """Base URL for our service"""
-    return app.send_static_file("index.html")
+    return current_app.send_static_file("index.html")
 
 
 ######################################################################
 # HEALTH
 ######################################################################
-@app.route("/health")
+@blueprint.route("/health")
 def health():
     """Health endpoint"""
     res = {"status": "OK"}
     return make_response(jsonify(res), status.HTTP_200_OK)
 
 
+######################################################################
+# CACHE STATISTICS
+######################################################################
+@blueprint.route("/cache/stats")
+def cache_stats():
+    """Returns the hit and miss counters of the model cache"""
+    return make_response(jsonify(cache.stats()), status.HTTP_200_OK)
+
+
+######################################################################
+# CONNECTION POOL STATISTICS
+######################################################################
+@blueprint.route("/pool/stats")
+def connection_pool_stats():
+    """Returns the live statistics of the database connection pool"""
+    stats = pool_stats(db.engine)
+    if replicas.engines:
+        stats["replicas"] = [
+            dict(pool_stats(engine), **health)
+            for engine, health in zip(replicas.engines, replicas.stats())
+        ]
+    return make_response(jsonify(stats), status.HTTP_200_OK)
+
+
+######################################################################
+# METRICS
+######################################################################
+@blueprint.route("/metrics")
+def metrics():
+    """Returns request, response size and SQL metrics in Prometheus text format"""
+    body, content_type = export_metrics()
+    return Response(body, status=status.HTTP_200_OK, content_type=content_type)
+
+
 ######################################################################
 #  R E S T   A P I   E N D P O I N T S
 ######################################################################
@@ -141,22 +466,29 @@ class WishlistResource(Resource):
     # ------------------------------------------------------------------
     # RETRIEVE A WISHLIST
     # ------------------------------------------------------------------
-    @api.doc("get_wishlist")
+    @api.doc("get_wishlist", params={"embed": "Set to items to include the Wishlist's items"})
+    @api.response(304, "Wishlist not modified since the If-None-Match ETag")
     @api.response(404, "Wishlist not found")
-    @api.marshal_with(wishlist_model)
+    @marshal_or_response(wishlist_model, fast=True)
     def get(self, wishlist_id):
         """
         Retrieves a single Wishlist
-        This endpoint will return a Wishlist based on it's id
+        This endpoint will return a Wishlist based on it's id, and its items
+        in wishlist_items when ?embed=items is given. Send the ETag of an
+        earlier response in If-None-Match to get a 304 if it is unchanged.
         """
-        app.logger.info("Request to Retrieve a Wishlist with id [%s]", wishlist_id)
-        wishlist = Wishlist.find(wishlist_id)
+        current_app.logger.info("Request to Retrieve a Wishlist with id [%s]", wishlist_id)
+        embed = get_embed_args()
+        wishlist = Wishlist.find(wishlist_id, embed=embed)
         if not wishlist:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Wishlist with id '{wishlist_id}' could not be found.",
             )
-        return wishlist.serialize(), status.HTTP_200_OK
+        etag = wishlist_etag(wishlist, request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        return wishlist.serialize(embed), status.HTTP_200_OK, {"ETag": quote_etag(etag)}
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING WISHLIST
@@ -164,15 +496,18 @@ class WishlistResource(Resource):
     @api.doc("update_wishlists")
     @api.response(404, "Wishlist not found")
     @api.response(400, "The posted Wishlist data was not valid")
+    @api.response(412, "The Wishlist changed since the If-Match ETag")
     @api.expect(wishlist_model)
-    @api.marshal_with(wishlist_model)
+    @marshal_or_response(wishlist_model)
     # @token_required
     def put(self, wishlist_id):
         """
         Updates a Wishlist
-        This endpoint will update n Wishlist based the body that is posted
+        This endpoint will update n Wishlist based the body that is posted.
+        Send the ETag of an earlier response in If-Match to only update the
+        Wishlist if nobody else has changed it since.
         """
-        app.logger.info("Request to update wishlist with id: %s", wishlist_id)
+        current_app.logger.info("Request to update wishlist with id: %s", wishlist_id)
         check_content_type("application/json")
 
         # See if the wishlist exists and abort if it doesn't
@@ -182,13 +517,15 @@ class WishlistResource(Resource):
                 status.HTTP_404_NOT_FOUND,
                 f"Wishlist with id '{wishlist_id}' was not found.",
             )
+        expected_version = get_if_match_version(wishlist)
         # Update from the json in the body of the request
         wishlist.deserialize(request.get_json())
         wishlist.id = wishlist_id
         # wishlist.name = newname
-        wishlist.update()
+        wishlist.update(expected_version)
 
-        return wishlist.serialize(), status.HTTP_200_OK
+        etag = wishlist_etag(wishlist)
+        return wishlist.serialize(), status.HTTP_200_OK, {"ETag": quote_etag(etag)}
 
     # ------------------------------------------------------------------
     # DELETE A WISHLIST
@@ -202,11 +539,11 @@ class WishlistResource(Resource):
 
         This endpoint will delete a Wishlist based the id specified in the path
         """
-        app.logger.info("Request to Delete a Wishlist with id [%s]", wishlist_id)
+        current_app.logger.info("Request to Delete a Wishlist with id [%s]", wishlist_id)
         wishlist = Wishlist.find(wishlist_id)
         if wishlist:
             wishlist.delete()
-            app.logger.info("Wishlist with id [%s] was deleted", wishlist_id)
+            current_app.logger.info("Wishlist with id [%s] was deleted", wishlist_id)
 
         return "", status.HTTP_204_NO_CONTENT
 
@@ -223,28 +560,73 @@ class WishlistsCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc("list_wishlists")
     @api.expect(wishlist_args, validate=True)
-    @api.marshal_list_with(wishlist_model)
+    @marshal_or_response(wishlist_model, as_list=True, fast=True, summary_model=wishlist_summary_model)
     def get(self):
-        """Returns all of the Wishlists"""
-        app.logger.info("Request for Wishlist lists")
+        """Returns all of the Wishlists
+
+        Pass ?limit= to page through the Wishlists in (created_date, id)
+        order. When more Wishlists may follow, the cursor for the next page
+        is returned in the X-Next-Cursor and Link response headers.
+        Pass ?fields=id,wishlist_name to only load and return those columns.
+        Pass ?embed=summary for each Wishlist's item_count and total_value.
+        Pass ?ids=1,2,3 to get those Wishlists in one query, in that order;
+        ids that were not found are listed in the X-Missing-Ids header.
+        Send "Accept: application/x-ndjson" to stream one Wishlist per line.
+        """
+        current_app.logger.info("Request for Wishlist lists")
 
         customer_id = (
             int(request.args.get("customer-id"))
             if request.args.get("customer-id")
             else None
         )
+        limit, after = get_page_args()
+        embed = get_embed_args(LIST_EMBEDDABLE)
+        columns = get_fields_args(Wishlist)
+
+        if "ids" in request.args:
+            ids = get_ids_args()
+            wishlists = Wishlist.find_many(ids, embed, columns)
+            missing = sorted(set(ids) - {wishlist.id for wishlist in wishlists})
+            results = [wishlist.serialize(embed, columns) for wishlist in wishlists]
+            return results, status.HTTP_200_OK, {"X-Missing-Ids": ",".join(map(str, missing))}
+
+        if wants_ndjson():
+            batch_size = current_app.config["STREAM_BATCH_SIZE"]
+            if customer_id is not None:
+                rows = Wishlist.find_by_customer_id(
+                    customer_id, limit, after, batch_size, embed, columns
+                )
+            else:
+                rows = Wishlist.all(limit, after, batch_size, embed, columns)
+            return ndjson_response(
+                (wishlist.serialize(embed, columns) for wishlist in rows),
+                wishlist_summary_model if "summary" in embed else wishlist_model,
+            )
 
         wishlists = []
 
         if customer_id is not None:
-            wishlists = Wishlist.find_by_customer_id(customer_id)
+            wishlists = Wishlist.find_by_customer_id(
+                customer_id, limit, after, embed=embed, fields=columns
+            )
         else:
-            wishlists = Wishlist.all()
+            wishlists = Wishlist.all(limit, after, embed=embed, fields=columns)
 
         # Return as an array of dictionaries
-        results = [wishlist.serialize() for wishlist in wishlists]
+        results = [wishlist.serialize(embed, columns) for wishlist in wishlists]
+
+        headers = {}
+        if limit is not None and len(wishlists) == limit:
+            cursor = encode_cursor(wishlists[-1])
+            next_url = api.url_for(
+                WishlistsCollection,
+                _external=True,
+                **dict(request.args, after=cursor),
+            )
+            headers = {"X-Next-Cursor": cursor, "Link": f'<{next_url}>; rel="next"'}
 
-        return results, status.HTTP_200_OK
+        return results, status.HTTP_200_OK, headers
 
     # ------------------------------------------------------------------
     # ADD A NEW WISHLIST
@@ -252,28 +634,71 @@ class WishlistsCollection(Resource):
     @api.doc("create_wishlists")
     @api.response(400, "The posted data was not valid")
     @api.expect(create_wishlist_model)
-    @api.marshal_with(wishlist_model, code=201)
+    @idempotent
+    @marshal_or_response(wishlist_model, code=201)
     def post(self):
         """
         Creates a Wishlist
         This endpoint will create a Wishlist based the data in the body that is posted
         """
-        app.logger.info("Request to Create a Wishlist")
+        current_app.logger.info("Request to Create a Wishlist")
         wishlist = Wishlist()
-        app.logger.debug("Payload = %s", api.payload)
+        current_app.logger.debug("Payload = %s", api.payload)
         wishlist.deserialize(api.payload)
         wishlist.create()
-        app.logger.info("Wishlist with new id [%s] created!", wishlist.id)
+        current_app.logger.info("Wishlist with new id [%s] created!", wishlist.id)
         location_url = api.url_for(
             WishlistResource, wishlist_id=wishlist.id, _external=True
         )
         return wishlist.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
 
 
+######################################################################
+#  PATH: /wishlists/{wishlist_id}/clone
+######################################################################
+@api.route("/wishlists/<int:wishlist_id>/clone")
+@api.param("wishlist_id", "The Wishlist identifier")
+class WishlistClone(Resource):
+    """Copies a Wishlist and its items"""
+
+    # ------------------------------------------------------------------
+    # CLONE A WISHLIST
+    # ------------------------------------------------------------------
+    @api.doc("clone_wishlist")
+    @api.response(404, "Wishlist not found")
+    @api.response(400, "The posted data was not valid")
+    @idempotent
+    @marshal_or_response(wishlist_model, code=201)
+    def post(self, wishlist_id):
+        """
+        Clones a Wishlist
+        This endpoint will copy a Wishlist and all of its items in one
+        transaction. Post {"wishlist_name": ..., "customer_id": ...} to give
+        the copy another name or owner.
+        """
+        current_app.logger.info("Request to clone Wishlist %s", wishlist_id)
+        data = {}
+        if request.data:
+            check_content_type("application/json")
+            data = request.get_json()
+            if not isinstance(data, dict):
+                abort(status.HTTP_400_BAD_REQUEST, "Body must be a JSON object")
+
+        wishlist = Wishlist.find(wishlist_id)
+        if not wishlist:
+            abort(
+                status.HTTP_404_NOT_FOUND, f"Wishlist with ID {wishlist_id} not found"
+            )
+        new_id = wishlist.clone(data.get("wishlist_name"), data.get("customer_id"))
+        current_app.logger.info("Wishlist %s cloned to [%s]", wishlist_id, new_id)
+        location_url = api.url_for(WishlistResource, wishlist_id=new_id, _external=True)
+        return Wishlist.find(new_id).serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+
+
 ######################################################################
 # PUBLISH A WISHLIST
 ######################################################################
-@app.route("/wishlists/<int:wishlist_id>/publish", methods=["PUT"])
+@blueprint.route("/wishlists/<int:wishlist_id>/publish", methods=["PUT"])
 def publish_wishlist(wishlist_id):
     """
     Publish a wishlist
@@ -317,18 +742,17 @@ class WishlistItemsResource(Resource):
     # ------------------------------------------------------------------
     @api.doc("get_wishlist_item")
     @api.response(404, "Wishlist Item not found")
-    @api.marshal_with(item_model)
+    @marshal_or_response(item_model, fast=True)
     def get(self, wishlist_id, item_id):
         """
         Reads an Item from existing Wishlist
         This endpoint will read an Item from a Wishlist based on the given id
         """
-        app.logger.info(
+        current_app.logger.info(
             "Request to read item: %d from Wishlist: %d", item_id, wishlist_id
         )
 
-        # Check if wishlist exists
-        item = WishlistItem.find(item_id)
+        item = WishlistItem.find_in_wishlist(wishlist_id, item_id)
         if not item:
             abort(
                 status.HTTP_404_NOT_FOUND,
@@ -343,34 +767,23 @@ class WishlistItemsResource(Resource):
     @api.response(404, "Wishlist Item not found")
     @api.response(400, "The posted Wishlist Item data was not valid")
     @api.expect(item_model)
-    @api.marshal_with(item_model)
+    @marshal_or_response(item_model)
     # @token_required
     def put(self, wishlist_id, item_id):
         """Update a wishlist item"""
-        app.logger.info(
+        current_app.logger.info(
             "Request to update Item %s for Wishlist id: %s", item_id, wishlist_id
         )
 
         # Validate content is JSON
         check_content_type("application/json")
 
-        # Find the specified Wishlist
-        wishlist = Wishlist.find(wishlist_id)
-        if not wishlist:
-            abort(
-                status.HTTP_404_NOT_FOUND, f"Wishlist with ID {wishlist_id} not found"
-            )
-
-        # Find the specified WishlistItem
-        wishlist_item = None
-        for item in wishlist.items:
-            if item.id == item_id:
-                wishlist_item = item
-                break
-
+        # Find the specified WishlistItem within the specified Wishlist
+        wishlist_item = WishlistItem.find_in_wishlist(wishlist_id, item_id)
         if not wishlist_item:
             abort(
-                status.HTTP_404_NOT_FOUND, f"Wishlist Item with ID {item_id} not found"
+                status.HTTP_404_NOT_FOUND,
+                f"Wishlist Item with ID {item_id} not found in Wishlist with ID {wishlist_id}",
             )
 
         wishlist_item.deserialize(request.get_json())
@@ -391,21 +804,13 @@ class WishlistItemsResource(Resource):
         This endpoint will delete an Item based the id specified in the path
         """
 
-        app.logger.info(
+        current_app.logger.info(
             "Request to delete Item %s for Wishlist id: %s", item_id, wishlist_id
         )
 
-        # Find the specified Wishlist
-        wishlist = Wishlist.find(wishlist_id)
-
-        # Find the specified WishlistItem
-        if wishlist:
-            wishlist_item = None
-            for item in wishlist.items:
-                if item.id == item_id:
-                    wishlist_item = item
-                    break
-
+        # Find the specified WishlistItem within the specified Wishlist
+        wishlist_item = WishlistItem.find_in_wishlist(wishlist_id, item_id)
+        if wishlist_item:
             wishlist_item.delete()
 
         return "", status.HTTP_204_NO_CONTENT
@@ -421,13 +826,23 @@ class WishlistItemsCollection(Resource):
     # ------------------------------------------------------------------
     # LIST ALL WISHLIST ITEMS
     # ------------------------------------------------------------------
-    @api.doc("list_wishlist_items")
+    @api.doc(
+        "list_wishlist_items",
+        params={"fields": "Comma separated columns to return, such as id,product_name"},
+    )
     # @api.expect(wishlist_args, validate=True)
-    @api.marshal_list_with(item_model)
+    @marshal_or_response(item_model, as_list=True, fast=True)
     def get(self, wishlist_id):
-        """Returns wishlist items based on query parameters"""
+        """Returns wishlist items based on query parameters
+
+        Pass ?q= to search product names, best matches first.
+        Pass ?fields=id,product_name to only return those columns.
+        Send "Accept: application/x-ndjson" to stream one Item per line.
+        Send the ETag of an earlier response in If-None-Match to get a 304
+        if no Item has changed since.
+        """
 
-        app.logger.info(
+        current_app.logger.info(
             "Request for all WishlistItems for Wishlist with id: %s", wishlist_id
         )
 
@@ -438,12 +853,19 @@ class WishlistItemsCollection(Resource):
                 status.HTTP_404_NOT_FOUND,
                 f"Wishlist with id '{wishlist_id}' could not be found.",
             )
+        etag = wishlist_etag(wishlist, b"items?" + request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
 
         query_params = request.args.to_dict()
 
         # Initialize base query for items related to this wishlist
         base_query = WishlistItem.query.filter_by(wishlist_id=wishlist_id)
 
+        # Rank by a product name search when one is given
+        if "q" in query_params:
+            base_query = WishlistItem.search(base_query, query_params["q"])
+
         # Check for query parameters and filter the base query accordingly
         if "product_id" in query_params:
             product_id_param = (
@@ -478,25 +900,39 @@ class WishlistItemsCollection(Resource):
             )
             base_query = base_query.filter_by(created_date=created_date_datetime)
 
+        columns = get_fields_args(WishlistItem)
+        base_query = WishlistItem.project(base_query, columns)
+
+        if wants_ndjson():
+            rows = WishlistItem.fetch(base_query, current_app.config["STREAM_BATCH_SIZE"])
+            return ndjson_response((item.serialize(columns) for item in rows), item_model)
+
         # Fetch the filtered results
-        results = [item.serialize() for item in base_query.all()]
+        results = [item.serialize(columns) for item in base_query.all()]
 
-        return results, status.HTTP_200_OK
+        return results, status.HTTP_200_OK, {"ETag": quote_etag(etag)}
 
     # ------------------------------------------------------------------
     # ADD A NEW WISHLIST ITEM
     # ------------------------------------------------------------------
-    @api.doc("create_wishlist_items")
+    @api.doc(
+        "create_wishlist_items",
+        params={"upsert": "Set to true to add the quantity to an Item with the same product_id"},
+    )
     @api.response(400, "The posted data was not valid")
+    @api.response(409, "The Wishlist already holds an Item with this product_id")
     @api.expect(create_item_model)
-    @api.marshal_with(item_model, code=201)
+    @idempotent
+    @marshal_or_response(item_model, code=201)
     def post(self, wishlist_id):
         """
         Creates a Wishlist Item and associates it with a specific Wishlist
         This endpoint will create a Wishlist Item based on the data in the request body
-        and associate it with the specified Wishlist.
+        and associate it with the specified Wishlist. A Wishlist holds each
+        product once: with ?upsert=true the quantity of an Item with the same
+        product_id is increased instead (200), otherwise that is a 409.
         """
-        app.logger.info("Request to create a Wishlist Item")
+        current_app.logger.info("Request to create a Wishlist Item")
 
         # Validate content is JSON
         check_content_type("application/json")
@@ -515,29 +951,263 @@ class WishlistItemsCollection(Resource):
             wishlist.id
         )  # Associate the item with the specified wishlist
 
-        # Append items to the wishlist
-        wishlist.items.append(wishlist_item)
-        wishlist.update()
+        code = status.HTTP_201_CREATED
+        if request.args.get("upsert", "").lower() in ("true", "1", "yes"):
+            if not wishlist_item.upsert():
+                code = status.HTTP_200_OK
+            wishlist_item = WishlistItem.find(wishlist_item.id)
+        else:
+            # Append items to the wishlist
+            wishlist.items.append(wishlist_item)
+            wishlist.update()
 
         # Create a message to return
         message = wishlist_item.serialize()
 
         return (
             message,
-            status.HTTP_201_CREATED,
+            code,
             {"Location": f"/api/wishlists/{wishlist.id}/items/{wishlist_item.id}"},
         )
 
 
+######################################################################
+#  PATH: /wishlists/{wishlist_id}/items/batch
+######################################################################
+@api.route("/wishlists/<int:wishlist_id>/items/batch")
+@api.param("wishlist_id", "The Wishlist identifier")
+class WishlistItemsBatch(Resource):
+    """Handles many Wishlist Item operations in one request"""
+
+    # ------------------------------------------------------------------
+    # APPLY A BATCH OF WISHLIST ITEM OPERATIONS
+    # ------------------------------------------------------------------
+    @api.doc("batch_wishlist_items")
+    @api.response(404, "Wishlist not found")
+    @api.response(400, "The posted operations were not valid")
+    @api.expect([item_operation_model])
+    @idempotent
+    @marshal_or_response(item_result_model, as_list=True)
+    def post(self, wishlist_id):
+        """
+        Creates, updates and deletes many Wishlist Items at once
+        This endpoint will apply every operation in the posted array in a
+        single transaction and return one result per operation
+        """
+        current_app.logger.info("Request to apply a batch of Items to Wishlist %s", wishlist_id)
+        check_content_type("application/json")
+
+        operations = request.get_json()
+        if not isinstance(operations, list) or not 0 < len(operations) <= current_app.config["BATCH_SIZE_MAX"]:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"Body must be an array of 1 to {current_app.config['BATCH_SIZE_MAX']} operations",
+            )
+
+        wishlist = Wishlist.find(wishlist_id)
+        if not wishlist:
+            abort(
+                status.HTTP_404_NOT_FOUND, f"Wishlist with ID {wishlist_id} not found"
+            )
+
+        results = WishlistItem.apply_batch(wishlist_id, operations)
+        return results, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /items
+######################################################################
+@api.route("/items", strict_slashes=False)
+class ItemSearchCollection(Resource):
+    """Handles searches for Wishlist Items across Wishlists"""
+
+    # ------------------------------------------------------------------
+    # SEARCH WISHLIST ITEMS
+    # ------------------------------------------------------------------
+    @api.doc("search_wishlist_items")
+    @api.expect(search_args, validate=True)
+    @api.response(400, "The search was not valid")
+    @marshal_or_response(item_model, as_list=True, fast=True)
+    def get(self):
+        """
+        Searches Wishlist Items by product name
+        This endpoint will return the Items, optionally of one customer's
+        Wishlists, whose product name matches ?q=, best matches first
+        """
+        args = search_args.parse_args()
+        current_app.logger.info("Request to search Wishlist Items for '%s'", args["q"])
+        limit, _ = get_page_args()
+
+        query = WishlistItem.query
+        if args["customer-id"] is not None:
+            query = query.join(Wishlist).filter(
+                Wishlist.customer_id == args["customer-id"]
+            )
+        query = WishlistItem.search(query, args["q"])
+        if limit:
+            query = query.limit(limit)
+
+        results = [item.serialize() for item in query.all()]
+        return results, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /items/prices
+######################################################################
+@api.route("/items/prices")
+class ItemPrices(Resource):
+    """Handles catalog price changes for the Items of every Wishlist"""
+
+    # ------------------------------------------------------------------
+    # PROPAGATE NEW PRODUCT PRICES
+    # ------------------------------------------------------------------
+    @api.doc("update_product_prices")
+    @api.response(400, "The posted prices were not valid")
+    @api.expect([price_model])
+    @marshal_or_response(price_result_model)
+    def post(self):
+        """
+        Sets the price of products in every Wishlist
+        This internal endpoint will set the product_price of all Items of
+        each posted product_id, in chunks of PRICE_CHUNK_SIZE products
+        """
+        current_app.logger.info("Request to update product prices")
+        check_content_type("application/json")
+
+        data = request.get_json()
+        if not isinstance(data, list) or not 0 < len(data) <= current_app.config["BATCH_SIZE_MAX"]:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"Body must be an array of 1 to {current_app.config['BATCH_SIZE_MAX']} prices",
+            )
+
+        prices = WishlistItem.deserialize_prices(data)
+        updated = WishlistItem.update_prices(
+            prices, current_app.config["PRICE_CHUNK_SIZE"], current_app.config["PRICE_MAX_ROWS"]
+        )
+        return {"products": len(prices), "updated": updated}, status.HTTP_200_OK
+
+
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
+def get_fields_args(resource):
+    """Returns the columns named in ?fields= after checking the model has them"""
+    columns = tuple(name for name in request.args.get("fields", "").split(",") if name)
+    unknown = set(columns) - set(resource.column_names())
+    if unknown:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"Unknown fields {', '.join(sorted(unknown))}; fields must be among "
+            f"{', '.join(resource.column_names())}",
+        )
+    return columns
+
+
+def get_ids_args():
+    """Returns the ids named in ?ids=, up to BATCH_SIZE_MAX of them"""
+    try:
+        ids = [int(by_id) for by_id in request.args["ids"].split(",") if by_id]
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, "ids must be a comma separated list of integers")
+    if not 0 < len(ids) <= current_app.config["BATCH_SIZE_MAX"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"ids must name 1 to {current_app.config['BATCH_SIZE_MAX']} Wishlists",
+        )
+    return ids
+
+
+def get_embed_args(embeddable=EMBEDDABLE):
+    """Returns the relationships named in ?embed= to include in the response"""
+    embed = tuple(name for name in request.args.get("embed", "").split(",") if name)
+    unknown = set(embed) - set(embeddable)
+    if unknown:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"Cannot embed {', '.join(sorted(unknown))}; embed must be one of {', '.join(embeddable)}",
+        )
+    return embed
+
+
+def wishlist_etag(wishlist, variant=b""):
+    """Returns the strong ETag of a Wishlist at its current version
+
+    Args:
+        wishlist (Wishlist): the Wishlist the response is built from
+        variant (bytes): what else shapes the response, such as its query string
+    """
+    etag = f"{wishlist.id}-{wishlist.version}"
+    if variant:
+        etag += "-" + hashlib.sha1(variant).hexdigest()[:12]
+    return etag
+
+
+def not_modified(etag):
+    """Returns a bodiless 304 Not Modified response for an unchanged ETag"""
+    resp = Response(status=status.HTTP_304_NOT_MODIFIED)
+    resp.set_etag(etag)
+    return resp
+
+
+def get_if_match_version(wishlist):
+    """Returns the Wishlist version named by If-Match, or None to skip the check"""
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    versions = []
+    for etag in if_match.as_set():
+        by_id, _, version = etag.partition("-")
+        version = version.split("-")[0]
+        if by_id == str(wishlist.id) and version.isdigit():
+            versions.append(int(version))
+    if not versions:
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            f"If-Match does not name a version of Wishlist {wishlist.id}",
+        )
+    return wishlist.version if wishlist.version in versions else versions[0]
+
+
+def wants_ndjson():
+    """Returns True when the client prefers an application/x-ndjson stream"""
+    return request.accept_mimetypes.best_match(["application/json", NDJSON]) == NDJSON
+
+
+def ndjson_response(rows, model):
+    """Streams serialized rows as newline delimited JSON, marshalled one at a time"""
+
+    convert = serializer_for(model)
+    projected = "fields" in request.args
+
+    def generate():
+        for row in rows:
+            data = convert(row)
+            if projected:
+                data = {key: data[key] for key in row}
+            yield dumps(data) + b"\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON)
+
+
+def get_page_args():
+    """Returns the (limit, after) keyset pagination query arguments"""
+    limit = request.args.get("limit", type=int)
+    after = request.args.get("after")
+    if "limit" in request.args and not 0 < (limit or 0) <= current_app.config["PAGE_SIZE_MAX"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"limit must be between 1 and {current_app.config['PAGE_SIZE_MAX']}",
+        )
+    return limit, after
+
+
 def check_content_type(media_type):
     """Checks that the media type is correct"""
     content_type = request.headers.get("Content-Type")
     if content_type and content_type == media_type:
         return
-    app.logger.error("Invalid Content-Type: %s", content_type)
+    current_app.logger.error("Invalid Content-Type: %s", content_type)
     abort(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
         f"Content-Type must be {media_type}",
@@ -144,7 +144,7 @@ $(function () {
     
             let ajax = $.ajax({
                 type: "GET",
-                url: `/api/wishlists/${wishlist_id}`,
+                url: `/api/wishlists/${wishlist_id}?embed=items`,
             });
     
             ajax.done(function(res) {
@@ -154,29 +154,23 @@ $(function () {
                 if (shouldFlashSuccess) {
                     flash_message("Success");
                 }
-                $.ajax({
-                    type: "GET",
-                    url: `/api/wishlists/${res.id}/items`,
-                }).done(function(res) {
-                    $("#wishlist-items-table tbody").empty();
-                    if (res.length > 0) {
-                        // create a table row for each item in the retrieved wishlist
-                        $.each(res, function(index, item) {
-                            $("#wishlist-items-table tbody").append(`<tr>
-                                <td>${item.id}</td>
-                                <td>${item.product_id}</td>
-                                <td>${item.product_name}</td>
-                                <td>${item.product_price}</td>
-                                <td>${item.quantity}</td>
-                                <td class="item-actions">
-                                    <button class="btn btn-sm btn-default item-edit-btn" data-wishlist-and-item-id="${item.wishlist_id}:${item.id}">Edit</button>
-                                    <button class="btn btn-sm btn-danger item-delete-btn" data-wishlist-and-item-id="${item.wishlist_id}:${item.id}">Delete</button>
-                                </td>
-                            </tr>`);
-                        });
-                    }
-                    resolve(res); // Resolve the promise when the asynchronous operations are done
+                let items = res.wishlist_items || [];
+                $("#wishlist-items-table tbody").empty();
+                // create a table row for each item in the retrieved wishlist
+                $.each(items, function(index, item) {
+                    $("#wishlist-items-table tbody").append(`<tr>
+                        <td>${item.id}</td>
+                        <td>${item.product_id}</td>
+                        <td>${item.product_name}</td>
+                        <td>${item.product_price}</td>
+                        <td>${item.quantity}</td>
+                        <td class="item-actions">
+                            <button class="btn btn-sm btn-default item-edit-btn" data-wishlist-and-item-id="${item.wishlist_id}:${item.id}">Edit</button>
+                            <button class="btn btn-sm btn-danger item-delete-btn" data-wishlist-and-item-id="${item.wishlist_id}:${item.id}">Delete</button>
+                        </td>
+                    </tr>`);
                 });
+                resolve(items); // Resolve the promise when the asynchronous operations are done
             });
     
             ajax.fail(function(res) {
@@ -34,7 +34,7 @@ class WishlistItemFactory(factory.Factory):
 
     id = factory.Sequence(lambda n: n)
     wishlist_id = FuzzyInteger(0, 1000)
-    product_id = FuzzyInteger(0, 255)
+    product_id = factory.Sequence(lambda n: n)  # unique within a wishlist
     product_name = factory.Faker("name")
     product_price = factory.Faker(
         "pyfloat", left_digits=2, right_digits=2, positive=True
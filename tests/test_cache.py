@@ -0,0 +1,125 @@
+"""
+Test cases for the model cache backends
+
+"""
+from unittest import TestCase
+from unittest.mock import patch
+import fakeredis
+from service import app
+from service.common.cache import LocalCache, ModelCache, NullCache, RedisCache
+
+
+######################################################################
+#  C A C H E   B A C K E N D   T E S T   C A S E S
+######################################################################
+class TestLocalCache(TestCase):
+    """Test Cases for the in-process LRU cache"""
+
+    def test_get_and_set(self):
+        """It should store and return values"""
+        cache = LocalCache()
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", {"id": 1})
+        self.assertEqual(cache.get("a"), {"id": 1})
+        cache.delete("a", "b")
+        self.assertIsNone(cache.get("a"))
+
+    def test_evict_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        cache = LocalCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+
+    @patch("service.common.cache.time.monotonic")
+    def test_expire_entries(self, monotonic):
+        """It should expire entries after their time to live"""
+        monotonic.return_value = 100.0
+        cache = LocalCache()
+        cache.set("a", 1, ttl=10)
+        monotonic.return_value = 109.0
+        self.assertEqual(cache.get("a"), 1)
+        monotonic.return_value = 111.0
+        self.assertIsNone(cache.get("a"))
+
+    def test_counters(self):
+        """It should increment counters and clear everything"""
+        cache = LocalCache()
+        self.assertEqual(cache.incr("n"), 1)
+        self.assertEqual(cache.incr("n"), 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class TestRedisCache(TestCase):
+    """Test Cases for the shared Redis cache"""
+
+    def setUp(self):
+        self.cache = RedisCache(None, client=fakeredis.FakeRedis())
+
+    def test_get_and_set(self):
+        """It should store and return values through Redis"""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", {"id": 1}, ttl=10)
+        self.assertEqual(self.cache.get("a"), {"id": 1})
+        self.assertEqual(self.cache.client.ttl("wishlists:a"), 10)
+        self.cache.delete("a")
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_counters(self):
+        """It should increment counters and clear only its own keys"""
+        self.cache.client.set("other", 1)
+        self.assertEqual(self.cache.incr("n"), 1)
+        self.assertEqual(self.cache.incr("n"), 2)
+        self.assertEqual(len(self.cache), 1)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.client.get("other"), b"1")
+
+
+class TestModelCache(TestCase):
+    """Test Cases for the model cache"""
+
+    def test_invalidate(self):
+        """It should forget rows and lists when they are invalidated"""
+        cache = ModelCache()
+        cache.backend = LocalCache()
+        cache.set(cache.row_key("t", 1), "row 1")
+        cache.set(cache.row_key("t", 2), "row 2")
+        cache.set(cache.list_key("t", "all"), ["row 1", "row 2"])
+
+        cache.invalidate("t", [1])
+        self.assertIsNone(cache.get(cache.row_key("t", 1)))
+        self.assertEqual(cache.get(cache.row_key("t", 2)), "row 2")
+        self.assertIsNone(cache.get(cache.list_key("t", "all")))
+
+        cache.invalidate("t", bulk=True)
+        self.assertIsNone(cache.get(cache.row_key("t", 2)))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 3)
+
+    def test_null_backend(self):
+        """It should cache nothing when turned off"""
+        cache = ModelCache()
+        cache.set("a", 1)
+        cache.invalidate("t", [1], bulk=True)
+        self.assertIsNone(cache.get("a"))
+        self.assertIsInstance(cache.backend, NullCache)
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_local_cache_needs_one_worker(self):
+        """It should turn a local cache off when more than one worker serves the app"""
+        cache = ModelCache()
+        with patch.dict(app.config, {"CACHE_BACKEND": "local", "WORKERS": 1}):
+            cache.init_app(app)
+            self.assertIsInstance(cache.backend, LocalCache)
+            app.config["WORKERS"] = 3
+            cache.init_app(app)
+            self.assertIsInstance(cache.backend, NullCache)
+        with patch.dict(app.config, {"CACHE_BACKEND": "redis", "CACHE_URL": "redis://localhost:6379/0", "WORKERS": 3}):
+            cache.init_app(app)
+            self.assertIsInstance(cache.backend, RedisCache)
@@ -4,15 +4,42 @@ CLI Command Extensions for Flask
 import os
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
-from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from service.common.cli_commands import (
+    build_index,
+    db_check,
+    db_create,
+    db_dedupe,
+    db_indexes,
+    missing_indexes,
+    purge_idempotency_keys,
+    update_prices,
+)
+from service import app
+from service.models import IdempotencyKey, Wishlist, WishlistItem, db
+from tests.factories import WishlistFactory, WishlistItemFactory
 
 
 class TestFlaskCLI(TestCase):
     """Test Flask CLI Commands"""
 
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        cls.app_context = app.app_context()
+        cls.app_context.push()
+        db.create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        db.session.query(Wishlist).delete()
+        db.session.commit()
+        cls.app_context.pop()
+
     def setUp(self):
-        self.runner = CliRunner()
+        self.runner = app.test_cli_runner()
 
     @patch('service.common.cli_commands.db')
     def test_db_create(self, db_mock):
@@ -21,3 +48,98 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    def test_db_check(self):
+        """It should report a missing schema and create it when asked"""
+        db.session.execute(text("DROP INDEX IF EXISTS ix_wishlist_created_date_id"))
+        db.session.execute(text("ALTER TABLE wishlist DROP COLUMN version"))
+        db.session.commit()
+
+        result = self.runner.invoke(db_check)
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Missing index ix_wishlist_created_date_id", result.output)
+        self.assertIn("Missing column wishlist.version", result.output)
+
+        db.session.execute(text("ALTER TABLE wishlist ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+        db.session.commit()
+        result = self.runner.invoke(db_check, ["--create"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("The database schema is up to date", result.output)
+
+    def test_db_indexes(self):
+        """It should report on and build the missing indexes"""
+        db.session.execute(text("DROP INDEX IF EXISTS ix_wishlist_created_date_id"))
+        db.session.commit()
+
+        result = self.runner.invoke(db_indexes, ["--dry-run"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Missing index ix_wishlist_created_date_id", result.output)
+
+        result = self.runner.invoke(db_indexes)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Building index ix_wishlist_created_date_id", result.output)
+        self.assertEqual(missing_indexes(), [])
+
+    def test_db_dedupe(self):
+        """It should merge duplicate products so the unique index can be built"""
+        db.session.query(WishlistItem).delete()
+        db.session.query(Wishlist).delete()
+        db.session.execute(text("DROP INDEX IF EXISTS uq_wishlist_items_wishlist_id_product_id"))
+        db.session.commit()
+        wishlist = WishlistFactory()
+        wishlist.create()
+        for product_id, quantity in ((7, 1), (7, 2), (7, 3), (8, 1)):
+            item = WishlistItemFactory(wishlist_id=wishlist.id, product_id=product_id, quantity=quantity)
+            item.create()
+
+        # a concurrent build fails on the duplicates and leaves the index INVALID
+        unique = next(
+            index for index in WishlistItem.__table__.indexes if index.name == "uq_wishlist_items_wishlist_id_product_id"
+        )
+        self.assertRaises(IntegrityError, build_index, unique)
+        self.assertIn(unique, missing_indexes())
+        result = self.runner.invoke(db_check)
+        self.assertIn("Missing index uq_wishlist_items_wishlist_id_product_id", result.output)
+
+        result = self.runner.invoke(db_dedupe, ["--batch-size", "1"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Merged 1 duplicate products", result.output)
+        items = db.session.query(WishlistItem).filter_by(wishlist_id=wishlist.id).all()
+        self.assertEqual(sorted((item.product_id, item.quantity) for item in items), [(7, 6), (8, 1)])
+
+        result = self.runner.invoke(db_indexes)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Building index uq_wishlist_items_wishlist_id_product_id", result.output)
+        self.assertEqual(missing_indexes(), [])
+
+    def test_update_prices(self):
+        """It should set the prices listed in a CSV file"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        WishlistItemFactory(wishlist_id=wishlist.id, product_id=3, product_price=1).create()
+        WishlistItemFactory(wishlist_id=wishlist.id, product_id=4, product_price=1).create()
+
+        with self.runner.isolated_filesystem():
+            with open("prices.csv", "w", encoding="utf-8") as prices:
+                prices.write("product_id,product_price\n3,2.50\n4,1\n")
+            result = self.runner.invoke(update_prices, ["prices.csv", "--chunk-size", "1"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Priced 1 of 2 products, 1 items updated", result.output)
+            self.assertIn("Updated the price of 1 items", result.output)
+
+            with open("prices.csv", "w", encoding="utf-8") as prices:
+                prices.write("3,cheap\n")
+            result = self.runner.invoke(update_prices, ["prices.csv"])
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn("Invalid price 0", result.output)
+
+    def test_purge_idempotency_keys(self):
+        """It should delete the expired idempotency keys"""
+        db.session.query(IdempotencyKey).delete()
+        db.session.commit()
+        IdempotencyKey.claim("key-1", "/api/wishlists", "a" * 64, ttl=60, lock_timeout=60)
+        result = self.runner.invoke(purge_idempotency_keys)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Deleted 0 expired idempotency keys", result.output)
+        result = self.runner.invoke(purge_idempotency_keys, ["--ttl", "-1"])
+        self.assertIn("Deleted 1 expired idempotency keys", result.output)
@@ -0,0 +1,116 @@
+"""
+Test cases for the gunicorn configuration
+
+"""
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from service import app
+from service.common.cache import LocalCache, NullCache
+from service.models import cache, db
+
+CONF_PATH = os.path.join(os.path.dirname(__file__), "..", "gunicorn.conf.py")
+spec = importlib.util.spec_from_file_location("gunicorn_conf", CONF_PATH)
+gunicorn_conf = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(gunicorn_conf)
+
+
+######################################################################
+#  G U N I C O R N   C O N F I G   T E S T   C A S E S
+######################################################################
+class TestGunicornConf(TestCase):
+    """Test Cases for the worker sizing and server hooks"""
+
+    def setUp(self):
+        self.cgroup = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        os.makedirs(os.path.join(self.cgroup.name, "cpu"))
+
+    def tearDown(self):
+        self.cgroup.cleanup()
+
+    def write(self, name, text):
+        """Writes a file under the fake cgroup directory"""
+        with open(os.path.join(self.cgroup.name, name), "w", encoding="utf-8") as file:
+            file.write(text)
+
+    def test_cpu_quota_v2(self):
+        """It should read the CPU limit of a cgroup v2 container"""
+        self.write("cpu.max", "25000 100000\n")
+        self.assertEqual(gunicorn_conf.cpu_quota(self.cgroup.name), 0.25)
+
+    def test_cpu_quota_v1(self):
+        """It should read the CPU limit of a cgroup v1 container"""
+        self.write("cpu/cpu.cfs_quota_us", "200000\n")
+        self.write("cpu/cpu.cfs_period_us", "100000\n")
+        self.assertEqual(gunicorn_conf.cpu_quota(self.cgroup.name), 2)
+
+    def test_cpu_quota_unlimited(self):
+        """It should count the usable CPUs when there is no limit"""
+        self.write("cpu.max", "max 100000\n")
+        self.assertGreaterEqual(gunicorn_conf.cpu_quota(self.cgroup.name), 1)
+        self.assertEqual(
+            gunicorn_conf.cpu_quota(self.cgroup.name), gunicorn_conf.cpu_quota("/nonexistent")
+        )
+
+    def test_memory_usage(self):
+        """It should add up the shared and private pages of smaps_rollup"""
+        self.write(
+            "smaps_rollup",
+            "00400000-7fff [rollup]\nRss: 1000 kB\nShared_Clean: 600 kB\nShared_Dirty: 100 kB\n"
+            "Private_Clean: 50 kB\nPrivate_Dirty: 250 kB\n",
+        )
+        usage = gunicorn_conf.memory_usage(os.path.join(self.cgroup.name, "smaps_rollup"))
+        self.assertEqual(usage, {"rss": 1000, "shared": 700, "private": 300})
+        self.assertEqual(gunicorn_conf.memory_usage("/nonexistent"), {})
+
+    def test_post_fork(self):
+        """It should give a forked worker an empty connection pool"""
+        server = MagicMock()
+        server.cfg.preload_app = True
+        with app.app_context():
+            engine = db.engine
+            with patch.object(engine, "dispose") as dispose:
+                gunicorn_conf.post_fork(server, MagicMock())
+                dispose.assert_called_once_with(close=False)
+                server.cfg.preload_app = False
+                gunicorn_conf.post_fork(server, MagicMock())
+                dispose.assert_called_once_with(close=False)
+
+    def test_when_ready(self):
+        """It should turn a local cache off before forking more than one worker"""
+        server = MagicMock()
+        server.cfg.preload_app = True
+        server.cfg.workers = 3
+        backend = cache.backend
+        cache.backend = LocalCache()
+        try:
+            with patch.dict(os.environ), patch.object(gunicorn_conf.gc, "freeze") as freeze:
+                gunicorn_conf.when_ready(server)
+                self.assertEqual(os.environ["GUNICORN_WORKERS"], "3")
+            freeze.assert_called_once()
+            self.assertIsInstance(cache.backend, NullCache)
+            server.log.warning.assert_called_once()
+        finally:
+            cache.backend = backend
+
+    def test_gevent_workers(self):
+        """It should patch for gevent before the app is imported"""
+        script = (
+            "import os, runpy, socket, gevent.socket;"
+            f"conf = runpy.run_path({CONF_PATH!r});"
+            "print(conf['worker_class'], conf['workers'], conf['worker_connections'],"
+            " socket.socket is gevent.socket.socket,"
+            " os.environ['PSYCOPG_WAIT_FUNC'], os.environ['LOG_ASYNC'])"
+        )
+        env = dict(os.environ, GUNICORN_WORKER_CLASS="gevent", GUNICORN_WORKERS="2")
+        env.pop("PSYCOPG_WAIT_FUNC", None)
+        env.pop("LOG_ASYNC", None)
+        result = subprocess.run(
+            [sys.executable, "-c", script], env=env, capture_output=True, text=True, timeout=60, check=False
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.split(), ["gevent", "2", "100", "True", "wait_select", "false"])
@@ -0,0 +1,143 @@
+"""
+Test cases for the logging pipeline
+
+"""
+import json
+import logging
+import queue
+from logging.handlers import BufferingHandler
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.common.log_handlers import (
+    DeferredQueueHandler,
+    JsonFormatter,
+    RequestFilter,
+    init_logging,
+    restart_queue_listener,
+    restart_queue_listeners,
+    start_queue_listener,
+)
+
+
+######################################################################
+#  L O G G I N G   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(TestCase):
+    """Test Cases for the asynchronous JSON logging pipeline"""
+
+    def setUp(self):
+        self.logger = logging.getLogger("tests.log_handlers")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.buffer = BufferingHandler(100)
+
+    def tearDown(self):
+        self.logger.handlers = []
+
+    def test_defer_formatting(self):
+        """It should queue the message and its arguments without formatting them"""
+        log_queue = queue.Queue(1)
+        self.logger.handlers = [DeferredQueueHandler(log_queue)]
+        payload = {"wishlist_name": "gifts"}
+        self.logger.debug("Payload = %s", payload)
+        self.logger.debug("dropped when the queue is full")
+        record = log_queue.get_nowait()
+        self.assertEqual(record.msg, "Payload = %s")
+        self.assertIs(record.args, payload)
+
+    def test_full_queue(self):
+        """It should write warnings at once and count the records dropped when the queue is full"""
+        log_queue = queue.Queue(1)
+        self.logger.handlers = [DeferredQueueHandler(log_queue, [self.buffer])]
+        self.logger.info("queued")
+        self.logger.info("dropped")
+        self.logger.debug("dropped")
+        self.logger.error("written at once")
+        self.assertEqual([record.getMessage() for record in self.buffer.buffer], ["written at once"])
+        log_queue.get_nowait()
+        self.logger.info("queued again")
+        self.assertEqual(
+            self.buffer.buffer[-1].getMessage(), "2 log records were dropped while the log queue was full"
+        )
+        self.assertEqual(log_queue.get_nowait().getMessage(), "queued again")
+
+    def test_queue_listener(self):
+        """It should hand queued records to the original handlers"""
+        self.logger.handlers = [self.buffer]
+        start_queue_listener(self.logger)
+        self.assertIsInstance(self.logger.handlers[0], DeferredQueueHandler)
+        self.logger.info("Request for %s", "wishlists")
+        self.logger.handlers[0].queue.join()
+        self.assertEqual(self.buffer.buffer[0].getMessage(), "Request for wishlists")
+
+    def test_restart_queue_listener(self):
+        """It should write records again after a fork, with a new queue and thread"""
+        self.logger.handlers = [self.buffer]
+        listener = start_queue_listener(self.logger)
+        handler = self.logger.handlers[0]
+        old_queue = handler.queue
+        restart_queue_listener(listener, handler)
+        self.assertIsNot(handler.queue, old_queue)
+        self.assertIs(listener.queue, handler.queue)
+        self.logger.info("Forked")
+        handler.queue.join()
+        self.assertEqual(self.buffer.buffer[0].getMessage(), "Forked")
+
+    def test_register_at_fork_once(self):
+        """It should register one fork hook that restarts every listener"""
+        with patch("service.common.log_handlers._LISTENERS", []), patch("os.register_at_fork") as register:
+            first = start_queue_listener(self.logger)
+            self.logger.handlers = [self.buffer]
+            second = start_queue_listener(self.logger)
+            register.assert_called_once_with(after_in_child=restart_queue_listeners)
+            with patch("service.common.log_handlers.restart_queue_listener") as restart:
+                restart_queue_listeners()
+            self.assertEqual([call.args[0] for call in restart.call_args_list], [first, second])
+
+    def test_json_formatter(self):
+        """It should format a record as one line of JSON with its request"""
+        self.buffer.setFormatter(JsonFormatter())
+        self.logger.handlers = [self.buffer]
+        self.logger.addFilter(RequestFilter())
+        with app.test_request_context("/api/wishlists", method="POST"):
+            try:
+                raise ValueError("bad")
+            except ValueError:
+                self.logger.exception("Cannot create %s", "wishlist")
+        entry = json.loads(self.buffer.format(self.buffer.buffer[0]))
+        self.assertEqual(entry["message"], "Cannot create wishlist")
+        self.assertEqual(entry["level"], "ERROR")
+        self.assertEqual(entry["method"], "POST")
+        self.assertEqual(entry["path"], "/api/wishlists")
+        self.assertIn("ValueError: bad", entry["exception"])
+
+    @patch("service.common.log_handlers.random.random", return_value=0.5)
+    def test_sample_by_endpoint(self, _):
+        """It should sample info records of busy endpoints but keep warnings"""
+        self.logger.handlers = [self.buffer]
+        self.logger.addFilter(RequestFilter({"wishlists_collection": 0.1}))
+        with app.test_request_context("/api/wishlists"):
+            self.logger.info("sampled out")
+            self.logger.warning("kept")
+        with app.test_request_context("/api/wishlists/1"):
+            self.logger.info("not sampled")
+        self.logger.info("outside a request")
+        messages = [record.getMessage() for record in self.buffer.buffer]
+        self.assertEqual(messages, ["kept", "not sampled", "outside a request"])
+
+    def test_init_logging(self):
+        """It should set up JSON logging on a background thread"""
+        gunicorn_logger = logging.getLogger("tests.gunicorn")
+        gunicorn_logger.handlers = [self.buffer]
+        gunicorn_logger.setLevel(logging.INFO)
+        handlers, filters, level = app.logger.handlers, app.logger.filters, app.logger.level
+        config = {"LOG_FORMAT": "json", "LOG_ASYNC": True}
+        try:
+            with patch.dict(app.config, config):
+                init_logging(app, "tests.gunicorn")
+            self.assertIsInstance(app.logger.handlers[0], DeferredQueueHandler)
+            self.assertIsInstance(self.buffer.formatter, JsonFormatter)
+        finally:
+            app.logger.handlers, app.logger.filters = handlers, filters
+            app.logger.setLevel(level)
@@ -0,0 +1,28 @@
+"""
+Test cases for the metrics exporter
+
+"""
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from prometheus_client import REGISTRY
+from service.common.metrics import metrics_registry
+
+
+######################################################################
+#  M E T R I C S   T E S T   C A S E S
+######################################################################
+class TestMetricsRegistry(TestCase):
+    """Test Cases for choosing the registry to export"""
+
+    def test_single_process(self):
+        """It should export the default registry in a single process"""
+        with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": ""}):
+            self.assertIs(metrics_registry(), REGISTRY)
+
+    def test_multiprocess(self):
+        """It should merge the samples of every worker in the shared directory"""
+        with tempfile.TemporaryDirectory() as path:
+            with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": path}):
+                self.assertIsNot(metrics_registry(), REGISTRY)
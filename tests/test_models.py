@@ -5,8 +5,20 @@ Test cases for Wishlist Model
 import os
 import logging
 import unittest
+from decimal import Decimal
+from sqlalchemy import event
 from service import app
-from service.models import Wishlist, WishlistItem, DataValidationError, db
+from service.models import (
+    IdempotencyKey,
+    Wishlist,
+    WishlistItem,
+    DataValidationError,
+    VersionConflictError,
+    cache,
+    db,
+    decode_cursor,
+    encode_cursor,
+)
 from tests.factories import WishlistFactory, WishlistItemFactory
 
 DATABASE_URI = os.getenv(
@@ -27,14 +39,19 @@ class TestWishlist(unittest.TestCase):
         app.config["TESTING"] = True
         app.config["DEBUG"] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        app.config["CACHE_BACKEND"] = "local"
+        cache.init_app(app)
         app.logger.setLevel(logging.CRITICAL)
-        Wishlist.init_db(app)
+        cls.app_context = app.app_context()
+        cls.app_context.push()
+        db.create_all()
 
     @classmethod
     def tearDownClass(cls):
         """This runs once after the entire test suite"""
         db.session.query(Wishlist).delete()  # clean up the last tests
         db.session.commit()
+        cls.app_context.pop()
 
     def setUp(self):
         """This runs before each test"""
@@ -230,6 +247,132 @@ class TestWishlist(unittest.TestCase):
         customer_lists = Wishlist.find_by_customer_id(2222)
         self.assertEqual(len(customer_lists), 2)
 
+    def test_list_wishlists_by_page(self):
+        """It should List Wishlists one keyset page at a time"""
+        for wishlist in WishlistFactory.create_batch(5):
+            wishlist.create()
+        expected = sorted(Wishlist.all(), key=lambda w: (w.created_date, w.id))
+
+        page = Wishlist.all(limit=2)
+        self.assertEqual([w.id for w in page], [w.id for w in expected[:2]])
+        page = Wishlist.all(limit=2, after=encode_cursor(page[-1]))
+        self.assertEqual([w.id for w in page], [w.id for w in expected[2:4]])
+        page = Wishlist.all(limit=2, after=encode_cursor(page[-1]))
+        self.assertEqual([w.id for w in page], [expected[4].id])
+
+    def test_find_by_customer_id_by_page(self):
+        """It should page through the wishlists of a customer"""
+        for wishlist in WishlistFactory.create_batch(3, customer_id=3333):
+            wishlist.create()
+        WishlistFactory(customer_id=4444).create()
+
+        page = Wishlist.find_by_customer_id(3333, limit=2)
+        self.assertEqual(len(page), 2)
+        page = Wishlist.find_by_customer_id(3333, 2, encode_cursor(page[-1]))
+        self.assertEqual(len(page), 1)
+        self.assertEqual(page[0].customer_id, 3333)
+
+    def test_stream_all_wishlists(self):
+        """It should stream Wishlists in batches instead of loading a list"""
+        for wishlist in WishlistFactory.create_batch(5):
+            wishlist.create()
+        rows = Wishlist.all(yield_per=2)
+        self.assertNotIsInstance(rows, list)
+        self.assertEqual(len(list(rows)), 5)
+
+    def count_queries(self, func):
+        """Returns the number of SQL statements run by func"""
+        statements = []
+
+        def count_statement(*_):
+            statements.append(1)
+
+        event.listen(db.engine, "before_cursor_execute", count_statement)
+        try:
+            func()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+        return len(statements)
+
+    def test_find_wishlist_from_cache(self):
+        """It should find a Wishlist from the cache until it is changed"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        wishlist_id = wishlist.id
+        Wishlist.find(wishlist_id)
+        db.session.remove()
+
+        hits = cache.hits
+        self.assertEqual(self.count_queries(lambda: Wishlist.find(wishlist_id)), 0)
+        self.assertEqual(cache.hits, hits + 1)
+
+        found = Wishlist.find(wishlist_id)
+        found.wishlist_name = "renamed"
+        found.update()
+        db.session.remove()
+        self.assertEqual(Wishlist.find(wishlist_id).wishlist_name, "renamed")
+
+        Wishlist.find(wishlist_id).delete()
+        self.assertIsNone(Wishlist.find(wishlist_id))
+
+    def test_list_wishlists_from_cache(self):
+        """It should cache pages of Wishlists until the table is written"""
+        for wishlist in WishlistFactory.create_batch(3):
+            wishlist.create()
+        self.assertEqual(len(Wishlist.all(limit=5)), 3)
+        self.assertEqual(self.count_queries(lambda: Wishlist.all(limit=5)), 0)
+
+        WishlistFactory().create()
+        self.assertEqual(len(Wishlist.all(limit=5)), 4)
+
+        db.session.query(Wishlist).delete()
+        db.session.commit()
+        self.assertEqual(Wishlist.all(limit=5), [])
+
+    def test_wishlist_version(self):
+        """It should bump a Wishlist's version whenever it or its items change"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        self.assertEqual(wishlist.version, 1)
+        wishlist.update()
+        self.assertEqual(wishlist.version, 1)
+
+        wishlist.wishlist_name = "renamed"
+        wishlist.update(expected_version=1)
+        self.assertEqual(wishlist.version, 2)
+
+        item = WishlistItemFactory(wishlist_id=wishlist.id)
+        item.create()
+        self.assertEqual(wishlist.version, 3)
+        item.quantity += 1
+        item.update()
+        self.assertEqual(Wishlist.find(wishlist.id).version, 4)
+        WishlistItem.apply_batch(wishlist.id, [{"op": "delete", "id": item.id}])
+        self.assertEqual(Wishlist.find(wishlist.id).version, 5)
+
+    def test_update_stale_version(self):
+        """It should not update a Wishlist that changed since the version given"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        wishlist.wishlist_name = "stale"
+        self.assertRaises(VersionConflictError, wishlist.update, expected_version=0)
+        self.assertNotEqual(Wishlist.find(wishlist.id).wishlist_name, "stale")
+
+    def test_list_wishlists_with_fields(self):
+        """It should only load and serialize the columns asked for"""
+        WishlistFactory().create()
+        db.session.expunge_all()
+        found = Wishlist.all(fields=("wishlist_name",))[0]
+        self.assertNotIn("customer_id", found.__dict__)
+        self.assertEqual(set(found.serialize(fields=("wishlist_name",))), {"wishlist_name"})
+
+    def test_cursor_round_trip(self):
+        """It should decode a cursor back to its (created_date, id) position"""
+        wishlist = WishlistFactory()
+        cursor = encode_cursor(wishlist)
+        self.assertEqual(decode_cursor(cursor), (wishlist.created_date, wishlist.id))
+        self.assertRaises(DataValidationError, decode_cursor, "not-a-cursor")
+
     def test_wishlist_find_by_customer_id_for_non_existent_customer_id(self):
         """It should return an empty list for non-existent customer id"""
 
@@ -311,11 +454,19 @@ class TestWishlistItem(unittest.TestCase):
 
     serialized = {}
 
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        cls.app_context = app.app_context()
+        cls.app_context.push()
+        db.create_all()
+
     @classmethod
     def tearDownClass(cls):
         """This runs once after the entire test suite"""
         db.session.query(Wishlist).delete()
         db.session.commit()
+        cls.app_context.pop()
 
     def setUp(self):
         """This runs before each test"""
@@ -515,3 +666,131 @@ class TestWishlistItem(unittest.TestCase):
         # Assert that there are now 5 wishlist_items in the database
         wishlists = WishlistItem.all()
         self.assertEqual(len(wishlists), 5)
+
+    def test_find_item_in_wishlist(self):
+        """It should find an item only within the wishlist that holds it"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        other = WishlistFactory()
+        other.create()
+        item = WishlistItemFactory(wishlist_id=wishlist.id)
+        item.create()
+
+        found = WishlistItem.find_in_wishlist(wishlist.id, item.id)
+        self.assertEqual(found.id, item.id)
+        self.assertIsNone(WishlistItem.find_in_wishlist(other.id, item.id))
+        self.assertIsNone(WishlistItem.find_in_wishlist(wishlist.id, item.id + 1))
+
+    def test_write_batch_sets_ids(self):
+        """It should give each Item of a batch the id of its own row"""
+        wishlists = WishlistFactory.create_batch(2)
+        for wishlist in wishlists:
+            wishlist.create()
+        items = [
+            WishlistItemFactory(wishlist_id=wishlists[n % 2].id, product_id=product_id)
+            for n, product_id in enumerate([30, 10, 10, 20])
+        ]
+        WishlistItem.write_batch(items, [], [])
+        for item in items:
+            found = WishlistItem.find(item.id)
+            self.assertEqual((found.wishlist_id, found.product_id), (item.wishlist_id, item.product_id))
+
+    def test_search_items_by_product_name(self):
+        """It should search items by product name words, best match first"""
+        wishlist = WishlistFactory()
+        wishlist.create()
+        for name in ["Lego Castle", "Lego Castle Lego Knight", "Wooden Train"]:
+            WishlistItemFactory(wishlist_id=wishlist.id, product_name=name).create()
+
+        found = WishlistItem.search(WishlistItem.query, "lego").all()
+        self.assertEqual(
+            [item.product_name for item in found],
+            ["Lego Castle Lego Knight", "Lego Castle"],
+        )
+        found = WishlistItem.search(WishlistItem.query, "cast kni").all()
+        self.assertEqual([item.product_name for item in found], ["Lego Castle Lego Knight"])
+        self.assertRaises(DataValidationError, WishlistItem.search, WishlistItem.query, "  ")
+
+    def test_update_prices(self):
+        """It should set the price of a product in every wishlist, in small transactions"""
+        wishlists = WishlistFactory.create_batch(3)
+        for wishlist in wishlists:
+            wishlist.create()
+            WishlistItemFactory(wishlist_id=wishlist.id, product_id=1, product_price=5).create()
+            WishlistItemFactory(wishlist_id=wishlist.id, product_id=2, product_price=7).create()
+        WishlistItemFactory(wishlist_id=wishlists[0].id, product_id=3, product_price=9).create()
+        versions = [Wishlist.find(wishlist.id).version for wishlist in wishlists]
+
+        progress = []
+        updated = WishlistItem.update_prices(
+            {1: Decimal("6.50"), 2: Decimal("7"), 3: Decimal("1")},
+            chunk_size=2,
+            max_rows=2,
+            progress=lambda *args: progress.append(args),
+        )
+        self.assertEqual(updated, 4)
+        self.assertEqual(progress, [(2, 3, 2), (2, 3, 3), (3, 3, 4)])
+        prices = {(item.product_id, item.product_price) for item in WishlistItem.all()}
+        self.assertEqual(prices, {(1, Decimal("6.50")), (2, Decimal("7")), (3, Decimal("1"))})
+        self.assertEqual(
+            [Wishlist.find(wishlist.id).version - version for wishlist, version in zip(wishlists, versions)],
+            [2, 1, 1],
+        )
+
+    def test_deserialize_prices(self):
+        """It should read new prices, keeping the last price of a repeated product"""
+        prices = WishlistItem.deserialize_prices(
+            [{"product_id": "1", "product_price": 2.5}, {"product_id": 1, "product_price": "3"}]
+        )
+        self.assertEqual(prices, {1: Decimal("3")})
+        self.assertRaises(DataValidationError, WishlistItem.deserialize_prices, [{"product_id": 1}])
+        self.assertRaises(
+            DataValidationError,
+            WishlistItem.deserialize_prices,
+            [{"product_id": 1, "product_price": "free"}],
+        )
+        for price in ("NaN", "Infinity", "-1", -0.5):
+            self.assertRaises(
+                DataValidationError,
+                WishlistItem.deserialize_prices,
+                [{"product_id": 1, "product_price": price}],
+            )
+
+    def test_claim_idempotency_key(self):
+        """It should let one request claim an Idempotency-Key until it expires"""
+        db.session.query(IdempotencyKey).delete()
+        db.session.commit()
+        self.assertIsNone(IdempotencyKey.claim("key-1", "/api/wishlists", "a" * 64, ttl=60, lock_timeout=60))
+        earlier = IdempotencyKey.claim("key-1", "/api/wishlists", "a" * 64, ttl=60, lock_timeout=60)
+        self.assertEqual(earlier.fingerprint, "a" * 64)
+        self.assertIsNone(earlier.status_code)
+
+        # a claim that was never completed is abandoned after lock_timeout
+        self.assertIsNone(IdempotencyKey.claim("key-1", "/api/wishlists", "b" * 64, ttl=60, lock_timeout=-1))
+        IdempotencyKey.complete("key-1", app.response_class(b"{}", status=201, headers={"Location": "/here"}))
+        earlier = IdempotencyKey.claim("key-1", "/api/wishlists", "b" * 64, ttl=60, lock_timeout=-1)
+        self.assertEqual((earlier.status_code, earlier.body), (201, b"{}"))
+        self.assertEqual(earlier.headers["Location"], "/here")
+
+        # a completed key is only replayed for ttl seconds
+        self.assertIsNone(IdempotencyKey.claim("key-1", "/api/wishlists", "c" * 64, ttl=-1, lock_timeout=60))
+        IdempotencyKey.release("key-1")
+        self.assertIsNone(db.session.get(IdempotencyKey, "key-1"))
+
+        IdempotencyKey.claim("key-2", "/api/wishlists", "a" * 64, ttl=60, lock_timeout=60)
+        self.assertEqual(IdempotencyKey.purge(ttl=60), 0)
+        self.assertEqual(IdempotencyKey.purge(ttl=-1), 1)
+
+    def test_serialize_wishlist_with_items(self):
+        """It should serialize a wishlist with its items embedded"""
+        wishlist = WishlistFactory()
+        wishlist.items.extend(WishlistItemFactory.create_batch(2))
+        wishlist.create()
+        wishlist_id = wishlist.id
+        db.session.expunge_all()
+
+        found = Wishlist.find(wishlist_id, embed=("items",))
+        self.assertIn("items", found.__dict__)
+        data = found.serialize(embed=("items",))
+        self.assertEqual(len(data["wishlist_items"]), 2)
+        self.assertNotIn("wishlist_items", found.serialize())
@@ -0,0 +1,58 @@
+"""
+Test cases for the read replica router
+
+"""
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import create_engine, exc, text
+from service.common.replicas import ReplicaRouter
+
+
+######################################################################
+#  R E P L I C A   R O U T E R   T E S T   C A S E S
+######################################################################
+class TestReplicaRouter(TestCase):
+    """Test Cases for choosing a healthy replica"""
+
+    def setUp(self):
+        self.path = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.engines = [
+            create_engine(f"sqlite:///{self.path.name}/replica_{number}.db") for number in range(2)
+        ]
+        self.router = ReplicaRouter(self.engines, retry_after=60)
+
+    def tearDown(self):
+        for engine in self.engines:
+            engine.dispose()
+        self.path.cleanup()
+
+    def test_round_robin(self):
+        """It should use the replicas in turn"""
+        chosen = [self.router.choose() for _ in range(4)]
+        self.assertEqual(chosen, self.engines * 2)
+        self.assertIsNone(ReplicaRouter().choose())
+
+    def test_skip_failed_replica(self):
+        """It should skip a replica that lost its connection until it is back up"""
+        first, second = self.engines
+        with patch.object(first.dialect, "connect", side_effect=first.dialect.loaded_dbapi.OperationalError):
+            self.assertRaises(exc.OperationalError, first.connect)
+        self.assertEqual([self.router.choose() for _ in range(3)], [second] * 3)
+        self.assertEqual(self.router.stats()[0]["healthy"], False)
+
+        self.router.retry_after = 0
+        self.router.mark_down(first)
+        self.assertEqual({self.router.choose() for _ in range(2)}, set(self.engines))
+        self.assertEqual([replica["healthy"] for replica in self.router.stats()], [True, True])
+
+    def test_check_replica(self):
+        """It should keep a replica down while it fails its SELECT 1"""
+        missing = create_engine(f"sqlite:///{os.path.join(self.path.name, 'missing', 'x.db')}")
+        router = ReplicaRouter([missing], retry_after=0)
+        router.mark_down(missing)
+        self.assertIsNone(router.choose())
+        self.assertFalse(router.stats()[0]["healthy"])
+        with self.engines[0].connect() as conn:
+            self.assertEqual(conn.execute(text("SELECT 1")).scalar(), 1)
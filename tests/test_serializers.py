@@ -0,0 +1,58 @@
+"""
+Test cases for the compiled serializers
+
+"""
+import json
+from decimal import Decimal
+from unittest import TestCase
+from flask_restx import marshal
+from service.common.serializers import compile_model, dumps, serializer_for
+from service.routes import item_model, item_result_model, wishlist_model
+
+ITEM = {
+    "id": 7,
+    "wishlist_id": 3,
+    "product_id": 11,
+    "product_name": "Lego Castle",
+    "product_price": Decimal("29.99"),
+    "quantity": 2,
+    "created_date": "2023-10-01",
+}
+
+
+######################################################################
+#  S E R I A L I Z E R   T E S T   C A S E S
+######################################################################
+class TestSerializers(TestCase):
+    """Test Cases for converting rows as marshal() does"""
+
+    def assert_same_as_marshal(self, data, model):
+        """Checks that the compiled serializer gives what marshal() gives"""
+        self.assertEqual(json.loads(dumps(compile_model(model)(data))), marshal(data, model))
+
+    def test_item(self):
+        """It should convert an Item, including its Decimal price"""
+        self.assert_same_as_marshal(ITEM, item_model)
+        self.assert_same_as_marshal({"id": 1}, item_model)
+
+    def test_wishlist_with_items(self):
+        """It should convert a Wishlist with and without embedded items"""
+        wishlist = {
+            "id": 3,
+            "customer_id": 5,
+            "wishlist_name": "gifts",
+            "is_public": None,
+            "created_date": "2023-10-01",
+            "version": 2,
+        }
+        self.assert_same_as_marshal(wishlist, wishlist_model)
+        self.assert_same_as_marshal(dict(wishlist, wishlist_items=[ITEM]), wishlist_model)
+
+    def test_batch_results(self):
+        """It should convert nested items that may be null"""
+        self.assert_same_as_marshal({"op": "delete", "id": 1, "status": 404}, item_result_model)
+        self.assert_same_as_marshal({"op": "create", "status": 201, "item": ITEM}, item_result_model)
+
+    def test_compile_once(self):
+        """It should compile each model only once"""
+        self.assertIs(serializer_for(item_model), serializer_for(item_model))